@@ -12,7 +12,6 @@ import shutil
 import re
 import subprocess
 import io
-from urllib.request import urlopen
 from awrapperlib import logger as log, resource
 
 DEFAULT_TOMCAT_PATH = '/opt/tomcat/latest/webapps'
@@ -135,9 +134,10 @@ def get_public_ip():
     Get public IP
     :return: String public IP
     """
-    my_ip = urlopen('http://ip.42.pl/raw').read()
-    log.echo_info('Public IP: %s' % my_ip.decode("utf-8"))
-    return my_ip.decode("utf-8") + '/32'
+    from awrapperlib import publicip
+    my_ip = publicip.get_public_ip()
+    log.echo_info('Public IP: %s' % my_ip)
+    return my_ip + '/32'
 
 
 def dir_name(path):
@@ -327,11 +327,11 @@ def call(cmd, **kwargs):
         log.echo_debug('Running command using STDIN pipe...')
         process = subprocess.Popen(cmd, stdin=subprocess.PIPE, **kwargs)
         _, _ = process.communicate(input_)
-        log.echo_debug('Return code [%d]' % process.returncode)
+        log.echo_debug('Return code [%d]', process.returncode)
         return process.returncode
     else:
         return_code = subprocess.call(cmd, **kwargs)
-        log.echo_debug('Return code [%d]' % return_code)
+        log.echo_debug('Return code [%d]', return_code)
         return return_code
 
 
@@ -349,7 +349,7 @@ def check_call(cmd, **kwargs):
         return return_code
     else:
         return_code = subprocess.check_call(cmd, **kwargs)
-        log.echo_debug('Return code [%d]' % return_code)
+        log.echo_debug('Return code [%d]', return_code)
         return return_code
 
 
@@ -361,8 +361,8 @@ def __dump_commands(cmd, **kwargs):
     """
     if 'dump' in kwargs:
         cmd = kwargs['dump']
-    log.echo_debug('Calling command-line: <<<%s>>>' % str(cmd))
-    log.echo_debug('kwargs: <<<%s>>>' % str(kwargs))
+    log.echo_debug('Calling command-line: <<<%s>>>', cmd)
+    log.echo_debug('kwargs: <<<%s>>>', kwargs)
 
 
 def check_output(cmd, **kwargs):
@@ -381,9 +381,9 @@ def check_output(cmd, **kwargs):
     else:
         process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
         out, err = process.communicate()
-    log.echo_debug('tempOut [%s]' % out)
-    log.echo_debug('tempErr [%s]' % err)
-    log.echo_debug('return code [%d]' % process.returncode)
+    log.echo_debug('tempOut [%s]', out)
+    log.echo_debug('tempErr [%s]', err)
+    log.echo_debug('return code [%d]', process.returncode)
     assert process.returncode == 0
     return out
 
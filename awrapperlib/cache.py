@@ -0,0 +1,130 @@
+"""
+Persistent JSON cache.
+
+Each cache is one JSON file under ~/.aw-wrapper/cache, loaded on first use and rewritten atomically on every
+change, so values survive between runs and a crashed run never leaves a half-written file behind. A write
+holds a lock file and merges the changes into the file on disk, so runs that overlap keep each other's
+entries. Expired entries are dropped on write and the oldest entries are evicted above max_entries.
+"""
+
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.aw-wrapper', 'cache')
+DEFAULT_MAX_ENTRIES = 1000
+
+
+class DiskCache:
+    """
+    Key/value cache kept in a JSON file, values must be JSON serializable
+    """
+
+    def __init__(self, name, ttl=None, cache_dir=DEFAULT_CACHE_DIR, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param name: Cache name, used as the file name
+        :param ttl: Seconds a value stays valid, None to keep values until evicted
+        :param cache_dir: Directory holding the cache files
+        :param max_entries: Maximum number of entries, the least recently stored are evicted first
+        """
+        self.file = os.path.join(cache_dir, name + '.json')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def get(self, key):
+        """
+        Get a cached value
+        :param key: Cache key
+        :return: Cached value, None if missing or expired
+        """
+        with self.lock:
+            entry = self.__load().get(key)
+        if entry is None or (entry['expires'] is not None and entry['expires'] < time.time()):
+            return None
+        return entry['value']
+
+    def set(self, key, value):
+        """
+        Store a value and write the cache file
+        :param key: Cache key
+        :param value: Value to store
+        """
+        now = time.time()
+        expires = now + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.__load()[key] = dict(expires=expires, stored=now, value=value)
+            self.__save({key: self.entries[key]})
+
+    def delete(self, key):
+        """
+        Remove a value and write the cache file
+        :param key: Cache key
+        """
+        with self.lock:
+            if self.__load().pop(key, None) is not None:
+                self.__save({key: None})
+
+    def __load(self):
+        if self.entries is None:
+            self.entries = self.__read()
+        return self.entries
+
+    def __read(self):
+        try:
+            with open(self.file) as cache_file:
+                entries = json.load(cache_file)
+        except (IOError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def __save(self, changes):
+        """
+        Merge changed entries into the file on disk under the lock file, then replace the file
+        :param changes: Dictionary of changed entries, None for a deleted entry
+        """
+        try:
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+            with open(self.file + '.lock', 'a') as lock_file:
+                self.__lock(lock_file, True)
+                try:
+                    entries = self.__read()
+                    for key, entry in changes.items():
+                        if entry is None:
+                            entries.pop(key, None)
+                        else:
+                            entries[key] = entry
+                    self.entries = self.__prune(entries)
+                    temp_file = '%s.%d.tmp' % (self.file, os.getpid())
+                    with open(temp_file, 'w') as cache_file:
+                        json.dump(self.entries, cache_file, default=str)
+                    os.replace(temp_file, self.file)
+                finally:
+                    self.__lock(lock_file, False)
+        except OSError:
+            pass
+
+    def __prune(self, entries):
+        now = time.time()
+        entries = {key: entry for key, entry in entries.items()
+                   if entry.get('expires') is None or entry['expires'] >= now}
+        if len(entries) > self.max_entries:
+            newest = sorted(entries, key=lambda key: entries[key].get('stored', 0), reverse=True)
+            entries = {key: entries[key] for key in newest[:self.max_entries]}
+        return entries
+
+    @staticmethod
+    def __lock(lock_file, locked):
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if locked else fcntl.LOCK_UN)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK if locked else msvcrt.LK_UNLCK, 1)
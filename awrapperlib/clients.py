@@ -0,0 +1,130 @@
+"""
+Process-wide boto3 session and client registry.
+
+Clients and resources are created once per (service, region) from a single session, so service
+models are parsed once and clients of the same service share their HTTP connection pool. boto3 is
+only imported when the first client is requested.
+"""
+
+import threading
+from awrapperlib import metrics
+
+DEFAULT_MAX_POOL_CONNECTIONS = 20
+DEFAULT_RETRY_MODE = 'adaptive'
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+CONFIG_PROPERTIES = ['max_pool_connections', 'retry_mode', 'max_attempts', 'connect_timeout', 'read_timeout']
+
+_REGISTRY = dict(session=None, settings={}, config=None, clients={}, resources={}, account=None)
+_REGISTRY_LOCK = threading.RLock()
+
+
+def configure(**kwargs):
+    """
+    Set the botocore configuration used by every client, clients already created are discarded when
+    the configuration changes
+    :param kwargs: Dictionary containing the properties file options (max_pool_connections, retry_mode,
+    max_attempts, connect_timeout, read_timeout)
+    """
+    settings = {prop: kwargs[prop] for prop in CONFIG_PROPERTIES if prop in kwargs}
+    with _REGISTRY_LOCK:
+        if _REGISTRY['settings'] == settings and _REGISTRY['config'] is not None:
+            return
+        _REGISTRY['settings'] = settings
+        _REGISTRY['config'] = None
+        _REGISTRY['clients'].clear()
+        _REGISTRY['resources'].clear()
+
+
+def get_config():
+    """
+    Get the botocore configuration shared by every client
+    :return: botocore Config instance
+    """
+    with _REGISTRY_LOCK:
+        if _REGISTRY['config'] is None:
+            from botocore.config import Config
+            settings = _REGISTRY['settings']
+            _REGISTRY['config'] = Config(
+                max_pool_connections=int(settings.get('max_pool_connections', DEFAULT_MAX_POOL_CONNECTIONS)),
+                retries=dict(mode=settings.get('retry_mode', DEFAULT_RETRY_MODE),
+                             max_attempts=int(settings.get('max_attempts', DEFAULT_MAX_ATTEMPTS))),
+                connect_timeout=float(settings.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT)),
+                read_timeout=float(settings.get('read_timeout', DEFAULT_READ_TIMEOUT)))
+        return _REGISTRY['config']
+
+
+def get_session():
+    """
+    Get the process-wide boto3 session
+    :return: boto3 Session instance
+    """
+    with _REGISTRY_LOCK:
+        if _REGISTRY['session'] is None:
+            import boto3
+            _REGISTRY['session'] = boto3.session.Session()
+        return _REGISTRY['session']
+
+
+def get_client(service, region):
+    """
+    Get the shared client of a service in a region, instrumented for API call accounting
+    :param service: Service name (ec2, rds, dms, etc)
+    :param region: Region name
+    :return: boto3 client
+    """
+    key = (service, region)
+    client = _REGISTRY['clients'].get(key)
+    if client is None:
+        with _REGISTRY_LOCK:
+            client = _REGISTRY['clients'].get(key)
+            if client is None:
+                client = get_session().client(service, region_name=region, config=get_config())
+                _REGISTRY['clients'][key] = metrics.instrument(client)
+    return client
+
+
+def get_resource(service, region):
+    """
+    Get the shared resource of a service in a region, instrumented for API call accounting
+    :param service: Service name (ec2, s3, etc)
+    :param region: Region name
+    :return: boto3 service resource
+    """
+    key = (service, region)
+    service_resource = _REGISTRY['resources'].get(key)
+    if service_resource is None:
+        with _REGISTRY_LOCK:
+            service_resource = _REGISTRY['resources'].get(key)
+            if service_resource is None:
+                service_resource = get_session().resource(service, region_name=region, config=get_config())
+                metrics.instrument(service_resource.meta.client)
+                _REGISTRY['resources'][key] = service_resource
+    return service_resource
+
+
+def new_resource(service, region):
+    """
+    Create a resource that is not shared, for a thread: boto3 resources are not thread-safe
+    :param service: Service name (ec2, s3, etc)
+    :param region: Region name
+    :return: boto3 service resource
+    """
+    with _REGISTRY_LOCK:
+        service_resource = get_session().resource(service, region_name=region, config=get_config())
+    metrics.instrument(service_resource.meta.client)
+    return service_resource
+
+
+def get_account_id(region):
+    """
+    Get the AWS account Id of the session credentials, asked once per process
+    :param region: Region of the STS endpoint to ask
+    :return: Account Id
+    """
+    if _REGISTRY['account'] is None:
+        account = get_client('sts', region).get_caller_identity()['Account']
+        with _REGISTRY_LOCK:
+            _REGISTRY['account'] = account
+    return _REGISTRY['account']
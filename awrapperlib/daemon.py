@@ -0,0 +1,167 @@
+"""
+Persistent daemon mode.
+
+A long-running process accepts main.py commands over a Unix socket, so boto3 sessions and clients,
+loaded modules and open SSH connections are kept warm between commands. Commands run one at a time;
+their log and stdout output is streamed back to the client as JSON lines. A command whose AWS_* or AW_*
+environment differs from the daemon's is refused and runs in the client process instead, so a different
+profile, region or credentials never run with the daemon's.
+"""
+
+import contextlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+from awrapperlib import logger as log
+
+SOCKET_ENV_VAR = 'AW_DAEMON_SOCKET'
+DEFAULT_SOCKET_NAME = 'aw-wrapper-%s.sock'
+STOP_COMMAND = ['daemon', 'stop']
+PING_COMMAND = ['daemon', 'ping']
+ENV_PREFIXES = ('AWS_', 'AW_')
+
+
+def get_environment():
+    """
+    Get the environment variables that change what a command does: AWS credentials, profile and region,
+    and the wrapper's own AW_* settings
+    :return: Dictionary of environment variables
+    """
+    return {key: value for key, value in os.environ.items()
+            if key.startswith(ENV_PREFIXES) and key != SOCKET_ENV_VAR}
+
+
+def get_socket_path():
+    """
+    Get the daemon socket path, overridden by $AW_DAEMON_SOCKET
+    :return: Socket path
+    """
+    default_path = os.path.join(tempfile.gettempdir(), DEFAULT_SOCKET_NAME % os.getuid())
+    return os.environ.get(SOCKET_ENV_VAR, default_path)
+
+
+class _StreamWriter(io.TextIOBase):
+    """
+    Text stream sending every write to the client as a JSON line
+    """
+    def __init__(self, client_file):
+        self.client_file = client_file
+
+    def write(self, text):
+        if text:
+            self.client_file.write((json.dumps(dict(out=text)) + '\n').encode('utf-8'))
+            self.client_file.flush()
+        return len(text)
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    """
+    Run one command and stream its output back
+    """
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode('utf-8'))
+        argv = request['argv']
+        if argv in (STOP_COMMAND, PING_COMMAND):
+            self.server.stopped = self.server.stopped or argv == STOP_COMMAND
+            self.__send(dict(exit=0))
+            return
+        environment = self.server.environment
+        client_environment = request.get('env', {})
+        differences = sorted(key for key in set(environment) | set(client_environment)
+                             if environment.get(key) != client_environment.get(key))
+        if differences:
+            self.__send(dict(refused='environment differs from the daemon: %s' % ', '.join(differences)))
+            return
+        writer = _StreamWriter(self.wfile)
+        handler = logging.StreamHandler(writer)
+        handler.setFormatter(logging.Formatter(log.LOG_DEFAULT_FORMAT, log.LOG_DEFAULT_DATE_FORMAT))
+        root_logger = logging.getLogger()
+        root_logger.addHandler(handler)
+        queue_logging = log.is_queue_logging()
+        exit_code = 0
+        cwd = os.getcwd()
+        try:
+            os.chdir(request.get('cwd', cwd))
+            with contextlib.redirect_stdout(writer):
+                self.server.runner(argv)
+        except SystemExit as error:
+            exit_code = error.code if isinstance(error.code, int) else 1
+        except Exception as error:
+            log.echo_error('Command %s failed: %r', argv, error)
+            exit_code = 1
+        finally:
+            os.chdir(cwd)
+            if not queue_logging:
+                # A log queue started by the command holds this handler, flush it before the exit message
+                log.stop_queue_logging()
+            root_logger.removeHandler(handler)
+        self.__send(dict(exit=exit_code))
+
+    def __send(self, message):
+        self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+
+def serve(runner, socket_path=None):
+    """
+    Run the daemon until a 'daemon stop' command is received
+    :param runner: Function running a command, receives the argument list without the script name
+    :param socket_path: Socket path, default is get_socket_path()
+    """
+    socket_path = socket_path or get_socket_path()
+    if os.path.exists(socket_path):
+        if send(PING_COMMAND, socket_path, output=io.StringIO()) is not None:
+            log.echo_error('Daemon already running on %s', socket_path)
+            return
+        os.unlink(socket_path)
+    server = socketserver.UnixStreamServer(socket_path, _CommandHandler)
+    os.chmod(socket_path, 0o600)
+    server.runner = runner
+    server.environment = get_environment()
+    server.stopped = False
+    log.echo_info('Daemon listening on %s', socket_path)
+    try:
+        while not server.stopped:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+        log.echo_info('Daemon stopped')
+
+
+def send(argv, socket_path=None, output=None):
+    """
+    Run a command in the daemon, writing its output as it arrives
+    :param argv: Command arguments without the script name
+    :param socket_path: Socket path, default is get_socket_path()
+    :param output: Stream for the command output, default is sys.stdout
+    :return: Exit code of the command, None when no daemon is listening or it refused the command
+    """
+    socket_path = socket_path or get_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        connection.close()
+        return None
+    output = output or sys.stdout
+    with connection, connection.makefile('rwb') as server_file:
+        server_file.write((json.dumps(dict(argv=argv, cwd=os.getcwd(), env=get_environment())) + '\n').encode('utf-8'))
+        server_file.flush()
+        for line in server_file:
+            message = json.loads(line.decode('utf-8'))
+            if 'refused' in message:
+                log.echo_warning('Not using the daemon, %s', message['refused'])
+                return None
+            if 'exit' in message:
+                return message['exit']
+            output.write(message['out'])
+            output.flush()
+    return 1
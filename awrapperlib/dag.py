@@ -0,0 +1,139 @@
+"""
+Dependency-graph executor.
+
+Steps declare the steps they depend on. Every step whose dependencies are done is submitted to a thread
+pool, so independent steps run concurrently, and each step is timed in its own span, a child of the span
+open when the graph runs. After the run the critical path, the chain of dependent steps that bounds the wall
+time, is logged next to the serial time.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from awrapperlib import logger as log
+
+DEFAULT_MAX_WORKERS = 4
+
+
+class _Step:
+    """
+    Graph step and its timings
+    """
+    def __init__(self, name, func, depends, description):
+        self.name = name
+        self.func = func
+        self.depends = list(depends)
+        self.description = description
+        self.start = None
+        self.end = None
+
+    def run(self, parent):
+        with log.span(self.description, parent=parent):
+            self.start = time.perf_counter()
+            try:
+                return self.func()
+            finally:
+                self.end = time.perf_counter()
+
+
+class TaskGraph:
+    """
+    Run steps in dependency order, independent steps concurrently
+    """
+
+    def __init__(self, name, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param name: Graph name, used in the log
+        :param max_workers: Maximum number of steps running at the same time
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.steps = {}
+
+    def add(self, name, func, depends=(), description=None):
+        """
+        Add a step
+        :param name: Step name, unique in the graph
+        :param func: Callable without arguments
+        :param depends: Names of the steps that must finish before this one starts
+        :param description: Span name of the step, default is the step name
+        """
+        assert name not in self.steps, 'Duplicate step %s' % name
+        self.steps[name] = _Step(name, func, depends, description or name)
+
+    def run(self):
+        """
+        Run every step, the first failure stops scheduling and is raised once the running steps finish
+        :return: Dictionary with the result of each step
+        """
+        self.__check()
+        results = {}
+        done = set()
+        running = {}
+        error = None
+        started = time.perf_counter()
+        parent = log.get_current_span()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name) as executor:
+            while True:
+                if error is None:
+                    for step in self.steps.values():
+                        if step.name not in done and step.name not in running.values() and \
+                                all(depend in done for depend in step.depends):
+                            running[executor.submit(step.run, parent)] = step.name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        done.add(name)
+                    except BaseException as e:
+                        error = error or e
+        if error is not None:
+            raise error
+        self.__report(time.perf_counter() - started)
+        return results
+
+    def get_critical_path(self):
+        """
+        Get the longest chain of dependent steps, by duration, of the last run
+        :return: Tuple (list of step names, seconds)
+        """
+        paths = {}
+        for name in self.__get_order():
+            step = self.steps[name]
+            best = max((paths[depend] for depend in step.depends), key=lambda path: path[1], default=([], 0))
+            paths[name] = (best[0] + [name], best[1] + (step.end - step.start))
+        return max(paths.values(), key=lambda path: path[1], default=([], 0))
+
+    def __report(self, elapsed):
+        serial = sum(step.end - step.start for step in self.steps.values())
+        path, duration = self.get_critical_path()
+        log.echo_info('%s finished in %.2fs (%.2fs if run serially), critical path %.2fs: %s' %
+                      (self.name, elapsed, serial, duration, ' -> '.join(path)))
+
+    def __check(self):
+        for step in self.steps.values():
+            for depend in step.depends:
+                assert depend in self.steps, 'Step %s depends on unknown step %s' % (step.name, depend)
+        self.__get_order()
+
+    def __get_order(self):
+        order = []
+        visiting = set()
+        visited = set()
+
+        def visit(name):
+            assert name not in visiting, 'Dependency cycle through step %s' % name
+            if name in visited:
+                return
+            visiting.add(name)
+            for depend in self.steps[name].depends:
+                visit(depend)
+            visiting.remove(name)
+            visited.add(name)
+            order.append(name)
+
+        for step_name in self.steps:
+            visit(step_name)
+        return order
@@ -0,0 +1,115 @@
+"""
+Local ledger of the AWS resources created by the wrapper.
+
+Every key pair, security group, instance and golden image the wrapper creates is recorded in a SQLite
+database under ~/.aw-wrapper with its account, region, Id, tags and, for key pairs, the local key file. Golden
+images are recorded by base image and user data script hash. Later runs resolve those resources from the
+ledger by (account, kind, region, name) instead of describing or recreating them, the account being the one
+of the current AWS credentials.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from awrapperlib import clients
+
+DEFAULT_LEDGER_FILE = os.path.join(os.path.expanduser('~'), '.aw-wrapper', 'ledger.db')
+LEDGER_FILE_ENV = 'AW_LEDGER_FILE'
+KEY_PAIR = 'key_pair'
+SECURITY_GROUP = 'security_group'
+INSTANCE = 'instance'
+GOLDEN_IMAGE = 'golden_image'
+
+_LEDGER = dict(connection=None, file=None)
+_LEDGER_LOCK = threading.Lock()
+
+
+def get_ledger_file():
+    """
+    Get the ledger database location
+    :return: Path of the ledger database, AW_LEDGER_FILE when set
+    """
+    return os.environ.get(LEDGER_FILE_ENV, DEFAULT_LEDGER_FILE)
+
+
+def __get_connection():
+    ledger_file = get_ledger_file()
+    if _LEDGER['connection'] is None or _LEDGER['file'] != ledger_file:
+        os.makedirs(os.path.dirname(ledger_file), exist_ok=True)
+        connection = sqlite3.connect(ledger_file, check_same_thread=False)
+        connection.execute('CREATE TABLE IF NOT EXISTS ledger (account TEXT, kind TEXT, region TEXT, name TEXT, '
+                           'resource_id TEXT, tags TEXT, key_path TEXT, created REAL, '
+                           'PRIMARY KEY (account, kind, region, name))')
+        connection.commit()
+        _LEDGER['connection'] = connection
+        _LEDGER['file'] = ledger_file
+    return _LEDGER['connection']
+
+
+def record(kind, region, name, resource_id, tags=None, key_path=None):
+    """
+    Record a resource created by the wrapper, replacing any previous record with the same name
+    :param kind: Resource kind (KEY_PAIR, SECURITY_GROUP, INSTANCE, GOLDEN_IMAGE)
+    :param region: Region name
+    :param name: Resource name, unique per kind and region
+    :param resource_id: AWS Id of the resource
+    :param tags: Dictionary of tags
+    :param key_path: Local key file, for key pairs
+    """
+    account = clients.get_account_id(region)
+    with _LEDGER_LOCK:
+        connection = __get_connection()
+        connection.execute('INSERT OR REPLACE INTO ledger VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (account, kind, region, name, resource_id, json.dumps(tags or {}), key_path, time.time()))
+        connection.commit()
+
+
+def get(kind, region, name):
+    """
+    Get a recorded resource
+    :param kind: Resource kind
+    :param region: Region name
+    :param name: Resource name
+    :return: Dictionary (account, kind, region, name, resource_id, tags, key_path, created), None if not recorded
+    """
+    account = clients.get_account_id(region)
+    with _LEDGER_LOCK:
+        row = __get_connection().execute('SELECT * FROM ledger WHERE account = ? AND kind = ? AND region = ? AND '
+                                         'name = ?', (account, kind, region, name)).fetchone()
+    return __to_dict(row) if row else None
+
+
+def remove(kind, region, name):
+    """
+    Forget a resource, e.g. when it was deleted outside of the wrapper
+    :param kind: Resource kind
+    :param region: Region name
+    :param name: Resource name
+    """
+    account = clients.get_account_id(region)
+    with _LEDGER_LOCK:
+        connection = __get_connection()
+        connection.execute('DELETE FROM ledger WHERE account = ? AND kind = ? AND region = ? AND name = ?',
+                           (account, kind, region, name))
+        connection.commit()
+
+
+def get_resources(kind=None, region=None):
+    """
+    Get the recorded resources of every account
+    :param kind: Only this resource kind, None for every kind
+    :param region: Only this region, None for every region
+    :return: List of dictionaries sorted by creation time
+    """
+    query = 'SELECT * FROM ledger WHERE (? IS NULL OR kind = ?) AND (? IS NULL OR region = ?) ORDER BY created'
+    with _LEDGER_LOCK:
+        rows = __get_connection().execute(query, (kind, kind, region, region)).fetchall()
+    return [__to_dict(row) for row in rows]
+
+
+def __to_dict(row):
+    account, kind, region, name, resource_id, tags, key_path, created = row
+    return dict(account=account, kind=kind, region=region, name=name, resource_id=resource_id, tags=json.loads(tags),
+                key_path=key_path, created=created)
@@ -1,15 +1,38 @@
+import atexit
+import functools
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import re
 import sys
 import math
+import threading
 import time
-import inspect
 
 SCRIPT_NAME = os.path.basename(sys.argv[0])
 LOG_DEFAULT_LEVEL = logging.INFO
 LOG_DEFAULT_FORMAT = '%(asctime)s %(message)s'
 LOG_DEFAULT_DATE_FORMAT = '%b-%d %H:%M:%S'
 LOG_INDENT = 58
+LOG_CALLER_MAX_DEPTH = 10
+LOG_QUEUE_SIZE = 10000
+LOG_QUEUE_BATCH_SIZE = 256
+LOG_QUEUE_OVERFLOW = 'drop'
+LOG_QUEUE_OVERFLOW_POLICIES = ['block', 'drop', 'drop_oldest']
+
+_LINE_BREAK_PATTERN = re.compile(r'\r\n|\r|\n')
+_LINE_BREAK_REPLACEMENT = '\n' + ' ' * LOG_INDENT
+_KEYWORD_PATTERN = re.compile(r'\{(timestamp|scriptname)\}')
+_LOGGER_FILE = os.path.normcase(os.path.abspath(__file__))
+_CALLER_NAMES = {}
+_QUEUE_SENTINEL = None
+_QUEUE_LOGGING = {}
+_SPANS = []
+_SPANS_LOCK = threading.Lock()
+_SPAN_STACK = threading.local()
+_SPAN_EPOCH = time.perf_counter()
 
 
 def get_logger(name):
@@ -40,6 +63,273 @@ class _AWLoggerAdapter(logging.LoggerAdapter):
         return msg, kwargs
 
 
+class _AWQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler with a bounded queue and an overflow policy
+    """
+    def __init__(self, log_queue, overflow):
+        super(_AWQueueHandler, self).__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def enqueue(self, record):
+        """
+        Put a record in the queue applying the overflow policy when full, called with the handler lock held
+        :param record: Log record
+        """
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                if self.overflow == 'drop':
+                    self.dropped += 1
+                    return
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+
+class _AWQueueListener(threading.Thread):
+    """
+    Background thread writing queued records to the real handlers in batches
+    """
+    def __init__(self, log_queue, handlers, batch_size):
+        super(_AWQueueListener, self).__init__(name='aw-log-listener', daemon=True)
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+
+    def run(self):
+        """
+        Take records from the queue until the sentinel is found
+        """
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _QUEUE_SENTINEL in batch:
+                self.__write_batch(batch[:batch.index(_QUEUE_SENTINEL)])
+                return
+            self.__write_batch(batch)
+
+    def stop(self):
+        """
+        Write the remaining records and stop the thread
+        """
+        self.queue.put(_QUEUE_SENTINEL)
+        self.join()
+
+    def __write_batch(self, records):
+        """
+        Write a batch of records, stream handlers get a single write and flush per batch
+        :param records: Log records
+        """
+        for handler in self.handlers:
+            accepted = [record for record in records if record.levelno >= handler.level and handler.filter(record)]
+            if not accepted:
+                continue
+            if not isinstance(handler, logging.StreamHandler) or handler.stream is None:
+                for record in accepted:
+                    handler.handle(record)
+                continue
+            handler.acquire()
+            try:
+                handler.stream.write(''.join(handler.format(record) + handler.terminator for record in accepted))
+                handler.flush()
+            except Exception:
+                handler.handleError(accepted[-1])
+            finally:
+                handler.release()
+
+
+def start_queue_logging(queue_size=LOG_QUEUE_SIZE, batch_size=LOG_QUEUE_BATCH_SIZE, overflow=LOG_QUEUE_OVERFLOW):
+    """
+    Move the root handlers behind a bounded queue written by a background thread, loggers returned by
+    get_logger propagate to the root logger so they go through the queue as well
+    :param queue_size: Maximum number of records waiting to be written
+    :param batch_size: Maximum number of records written per batch
+    :param overflow: Policy when the queue is full: block, drop (newest) or drop_oldest
+    """
+    assert overflow in LOG_QUEUE_OVERFLOW_POLICIES, 'Invalid log queue overflow policy %s' % overflow
+    if _QUEUE_LOGGING:
+        return
+    root_logger = logging.getLogger()
+    handlers = list(root_logger.handlers)
+    log_queue = queue.Queue(int(queue_size))
+    queue_handler = _AWQueueHandler(log_queue, overflow)
+    listener = _AWQueueListener(log_queue, handlers, int(batch_size))
+    for handler in handlers:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+    listener.start()
+    _QUEUE_LOGGING.update(handler=queue_handler, listener=listener)
+    atexit.register(stop_queue_logging)
+
+
+def is_queue_logging():
+    """
+    Check if the root handlers are behind the log queue
+    :return: True when start_queue_logging is active
+    """
+    return bool(_QUEUE_LOGGING)
+
+
+def stop_queue_logging():
+    """
+    Flush the queued records and give the root handlers back to the root logger
+    """
+    if not _QUEUE_LOGGING:
+        return
+    queue_handler = _QUEUE_LOGGING.pop('handler')
+    listener = _QUEUE_LOGGING.pop('listener')
+    root_logger = logging.getLogger()
+    root_logger.removeHandler(queue_handler)
+    listener.stop()
+    for handler in listener.handlers:
+        root_logger.addHandler(handler)
+    if queue_handler.dropped:
+        echo_warning('Log queue overflow, %d records dropped', queue_handler.dropped)
+
+
+class _AWSpan:
+    """
+    Timing span, records the duration of a pipeline step and its parent span
+    """
+    def __init__(self, name, args, parent=None):
+        self.name = name
+        self.args = args
+        self.parent = parent
+        self.depth = 0
+        self.thread_id = None
+        self.start = None
+        self.duration = None
+
+    def __enter__(self):
+        stack = getattr(_SPAN_STACK, 'spans', None)
+        if stack is None:
+            stack = _SPAN_STACK.spans = []
+        if stack:
+            self.parent = stack[-1]
+        self.depth = self.parent.depth + 1 if self.parent is not None else 0
+        self.thread_id = threading.get_ident()
+        stack.append(self)
+        echo_info(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self.start
+        _SPAN_STACK.spans.pop()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        with _SPANS_LOCK:
+            _SPANS.append(self)
+        echo_debug('Finished %s in %.3fs', self.name, self.duration)
+        return False
+
+
+def span(name, parent=None, **args):
+    """
+    Time a pipeline step, to be used as a context manager. Logs the step name when it starts
+    :param name: Step name
+    :param parent: Parent span when the step runs in another thread than its caller, the spans open in the
+    current thread take precedence
+    :param args: Extra values stored in the trace event
+    :return: Span context manager
+    """
+    return _AWSpan(name, args, parent)
+
+
+def get_current_span():
+    """
+    Get the innermost span open in the current thread
+    :return: Span, None outside of any span
+    """
+    stack = getattr(_SPAN_STACK, 'spans', None)
+    return stack[-1] if stack else None
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of the function in a span
+    :param name: Step name, default is the function qualified name
+    :return: Decorator
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _AWSpan(span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_span_summary():
+    """
+    Get the recorded spans aggregated by name, in the order the steps started
+    :return: List of [name, depth, count, total seconds, max seconds]
+    """
+    with _SPANS_LOCK:
+        spans = sorted(_SPANS, key=lambda recorded: recorded.start)
+    summary = {}
+    for recorded in spans:
+        row = summary.setdefault(recorded.name, [recorded.name, recorded.depth, 0, 0.0, 0.0])
+        row[2] += 1
+        row[3] += recorded.duration
+        row[4] = max(row[4], recorded.duration)
+    return list(summary.values())
+
+
+def write_trace(file_name):
+    """
+    Write the recorded spans as a Chrome trace-event JSON file (chrome://tracing, Perfetto)
+    :param file_name: Trace file name
+    """
+    pid = os.getpid()
+    with _SPANS_LOCK:
+        events = [dict(name=recorded.name, cat='aw', ph='X', pid=pid, tid=recorded.thread_id,
+                       ts=round((recorded.start - _SPAN_EPOCH) * 1e6), dur=round(recorded.duration * 1e6),
+                       args=recorded.args) for recorded in _SPANS]
+    with open(file_name, 'w') as trace_file:
+        json.dump(dict(traceEvents=events, displayTimeUnit='ms'), trace_file)
+    echo_info('Trace written to %s', file_name)
+
+
+def reset_spans():
+    """
+    Clear the recorded spans
+    """
+    with _SPANS_LOCK:
+        del _SPANS[:]
+
+
+def end_spans(trace_file=None):
+    """
+    Log the span summary table and optionally write the Chrome trace file
+    :param trace_file: Trace file name, None to skip it
+    """
+    summary = get_span_summary()
+    if not summary:
+        return
+    lines = ['%-60s %6s %10s %10s' % ('Step', 'Calls', 'Total (s)', 'Max (s)')]
+    for name, depth, count, total, maximum in summary:
+        lines.append('%-60s %6d %10.3f %10.3f' % ('  ' * depth + name, count, total, maximum))
+    echo_info('Step timings:\n' + '\n'.join(lines))
+    if trace_file:
+        write_trace(trace_file)
+
+
 def __get_echo_msg(msg, log_level):
     """
     Get message with keywords replaced
@@ -47,82 +337,124 @@ def __get_echo_msg(msg, log_level):
     :param log_level: Log level
     :return: Message to be logged
     """
-    if isinstance(msg, str):
-        if r'{timestamp}' in msg.lower():
-            timestamp = math.floor(time.time())
-            msg = msg.replace('{timestamp}', '%d' % timestamp)
-        if r'{scriptname}' in msg.lower():
-            msg = msg.replace('{scriptname}', SCRIPT_NAME)
+    if isinstance(msg, str) and '{' in msg:
+        msg = _KEYWORD_PATTERN.sub(__replace_keyword, msg)
     caller_name, caller_line = __get_echo_caller()
     msg = '%-27s %-5s %-7s %s' % (caller_name, caller_line, log_level, msg)
     return msg
 
 
+def __replace_keyword(match):
+    """
+    Get the value of a message keyword
+    :param match: Regular expression match of the keyword
+    :return: Keyword value
+    """
+    if match.group(1) == 'timestamp':
+        return '%d' % math.floor(time.time())
+    return SCRIPT_NAME
+
+
 def __get_echo_caller():
     """
-    Uses the stack to determine frame immediately before a qd.echo_* call.  When called during
-    the output of an echo statement, provides the calling module/line in order to make resulting
-    log more useful.
+    Walks the raw frames to determine the frame immediately before an echo_* call, skipping frames of
+    this module such as spans.  When called during the output of an echo statement, provides the calling
+    module/line in order to make resulting log more useful. Module names are cached per code object.
     :return Tuple (module_name, module_line):
     """
+    frame = sys._getframe(1)
+    depth = 0
+    while frame is not None and depth < LOG_CALLER_MAX_DEPTH:
+        code = frame.f_code
+        if code.co_name.startswith('echo_') and __is_logger_code(code):
+            frame = frame.f_back
+            while frame is not None and __is_logger_code(frame.f_code):
+                frame = frame.f_back
+            break
+        frame = frame.f_back
+        depth += 1
+    else:
+        frame = None
+    if frame is None:
+        return os.path.splitext(SCRIPT_NAME)[0], '---'
+    code = frame.f_code
     try:
-        stack_level = 1
-        frame = inspect.stack()[stack_level]
-        frame_module = frame[1]
-        frame_method = frame[3]
-        while not (str(frame_module).endswith('aw.py') and
-                   str(frame_method).startswith('echo_')) and stack_level < 10:
-            try:
-                stack_level += 1
-                frame = inspect.stack()[stack_level]
-                frame_module = frame[1]
-                frame_method = frame[3]
-            except IndexError:
-                raise IndexError
-        frame = inspect.stack()[stack_level + 1]
-        frame_module = frame[1]
-        frame_line = frame[2]
-    except Exception or BaseException:
-        frame_module = SCRIPT_NAME
-        frame_line = '---'
-    index_start = str(frame_module).rfind(os.path.sep)
-    index_end = str(frame_module).rfind('.')
-    return frame_module[index_start + 1:index_end], frame_line
+        caller_name = _CALLER_NAMES[code]
+    except KeyError:
+        caller_name = _CALLER_NAMES[code] = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return caller_name, frame.f_lineno
+
+
+def __is_logger_code(code):
+    """
+    Check if a code object belongs to this module
+    :param code: Code object
+    :return: True if the code was defined in this module, else False
+    """
+    try:
+        return _CALLER_NAMES[code] is None
+    except KeyError:
+        pass
+    if os.path.normcase(os.path.abspath(code.co_filename)) == _LOGGER_FILE:
+        _CALLER_NAMES[code] = None
+        return True
+    return False
 
 
 LOGGER = get_logger(__name__)
 
 
-def echo_debug(msg):
+def echo_debug(msg, *args):
     """
     Echo DEBUG message
-    :param msg: message to be logged
+    :param msg: message to be logged, or a callable returning it
+    :param args: %-style arguments merged into the message only when DEBUG is enabled
     """
-    LOGGER.debug(__get_echo_msg(wrap_long_lines(msg), 'DEBUG'))
+    __echo(logging.DEBUG, 'DEBUG', msg, args)
 
 
-def echo_info(msg):
+def echo_info(msg, *args):
     """
     Echo INFO message
-    :param msg: message to be logged
+    :param msg: message to be logged, or a callable returning it
+    :param args: %-style arguments merged into the message only when INFO is enabled
     """
-    LOGGER.info(__get_echo_msg(wrap_long_lines(msg), 'INFO'))
+    __echo(logging.INFO, 'INFO', msg, args)
 
 
-def echo_error(msg):
+def echo_error(msg, *args):
     """
     Echo ERROR message
-    :param msg: message to be logged
+    :param msg: message to be logged, or a callable returning it
+    :param args: %-style arguments merged into the message only when ERROR is enabled
     """
-    LOGGER.error(__get_echo_msg(wrap_long_lines(msg), 'ERROR'))
+    __echo(logging.ERROR, 'ERROR', msg, args)
 
 
-def echo_warning(msg):
+def echo_warning(msg, *args):
     """
     Echo WARNING message
-    :param msg: message to be logged
+    :param msg: message to be logged, or a callable returning it
+    :param args: %-style arguments merged into the message only when WARNING is enabled
     """
-    LOGGER.warning(__get_echo_msg(wrap_long_lines(msg), 'WARNING'))
+    __echo(logging.WARNING, 'WARNING', msg, args)
+
+
+def __echo(level, level_name, msg, args):
+    """
+    Format and log a message, skipping all formatting and frame work when the level is disabled
+    :param level: Logging level
+    :param level_name: Level name written in the message
+    :param msg: Message to be logged, or a callable returning it
+    :param args: %-style arguments for the message
+    """
+    if not LOGGER.isEnabledFor(level):
+        return
+    if callable(msg):
+        msg = msg()
+    if args:
+        msg = msg % args
+    LOGGER.log(level, __get_echo_msg(wrap_long_lines(msg), level_name))
 
 
 def wrap_long_lines(msg):
@@ -131,14 +463,6 @@ def wrap_long_lines(msg):
     :param msg: Message to wrapped
     :return: Message wrapped
     """
-    return_msg = msg
-    if '\n' in msg or '\r' in msg or '\r\n' in msg:
-        if '\r\n' in return_msg:
-            return_msg = return_msg.replace('\r\n', '~!@#$%^&*' + ' ' * LOG_INDENT)
-        if '\n' in return_msg:
-            return_msg = return_msg.replace('\n', '~!@#$%^&*' + ' ' * LOG_INDENT)
-        if '\r' in return_msg:
-            return_msg = return_msg.replace('\r', '~!@#$%^&*' + ' ' * LOG_INDENT)
-        return return_msg.replace('~!@#$%^&*', '\n')
-    else:
-        return msg
+    if not isinstance(msg, str):
+        msg = str(msg)
+    return _LINE_BREAK_PATTERN.sub(_LINE_BREAK_REPLACEMENT, msg)
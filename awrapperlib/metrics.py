@@ -0,0 +1,197 @@
+"""
+AWS API call accounting.
+
+Hooks botocore before/after-call events on the clients created by the wrapper and keeps, per
+service/operation, the number of calls, retries, throttles, errors and a latency histogram. Local
+caches record their hits, which are the API calls saved.
+"""
+
+import json
+import threading
+import time
+from awrapperlib import logger as log
+
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+THROTTLE_ERROR_CODES = ['Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled',
+                        'RequestThrottledException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                        'ProvisionedThroughputExceededException', 'SlowDown', 'EC2ThrottledException',
+                        'BandwidthLimitExceeded', 'PriorRequestNotComplete']
+_START_KEY = 'aw_metrics_start'
+_STATS = {}
+_CACHES = {}
+_STATS_LOCK = threading.Lock()
+
+
+class _OperationStats:
+    """
+    Counters of one service operation
+    """
+    def __init__(self, service, operation):
+        self.service = service
+        self.operation = operation
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add_call(self, latency, retries, error):
+        """
+        Record a finished call
+        :param latency: Call latency in seconds, including retries
+        :param retries: Number of retries made by botocore
+        :param error: True if the call failed
+        """
+        self.calls += 1
+        self.retries += retries
+        self.errors += 1 if error else 0
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        latency_ms = latency * 1000
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS_MS) and latency_ms > LATENCY_BUCKETS_MS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+    def as_dict(self):
+        """
+        Get the counters as dictionary
+        :return: Dictionary of counters
+        """
+        labels = ['<=%dms' % bucket for bucket in LATENCY_BUCKETS_MS] + ['>%dms' % LATENCY_BUCKETS_MS[-1]]
+        return dict(service=self.service, operation=self.operation, calls=self.calls, errors=self.errors,
+                    retries=self.retries, throttles=self.throttles, total_latency=self.total_latency,
+                    max_latency=self.max_latency, histogram=dict(zip(labels, self.histogram)))
+
+
+def instrument(client):
+    """
+    Register the accounting hooks on a boto3 client, registering twice has no effect
+    :param client: boto3 client, for resources use resource.meta.client
+    :return: The same client
+    """
+    events = client.meta.events
+    events.register('before-call', __before_call, unique_id='aw-metrics-before-call')
+    events.register('after-call', __after_call, unique_id='aw-metrics-after-call')
+    events.register('after-call-error', __after_call_error, unique_id='aw-metrics-after-call-error')
+    events.register('response-received', __response_received, unique_id='aw-metrics-response-received')
+    return client
+
+
+def __get_stats(model):
+    """
+    Get the counters of an operation
+    :param model: botocore operation model
+    :return: _OperationStats instance
+    """
+    key = (model.service_model.service_name, model.name)
+    stats = _STATS.get(key)
+    if stats is None:
+        with _STATS_LOCK:
+            stats = _STATS.setdefault(key, _OperationStats(*key))
+    return stats
+
+
+def __before_call(model, context, **_):
+    context[_START_KEY] = (time.perf_counter(), __get_stats(model))
+
+
+def __after_call(parsed, context, **_):
+    if _START_KEY not in context:
+        return
+    start, stats = context.pop(_START_KEY)
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    with _STATS_LOCK:
+        stats.add_call(time.perf_counter() - start, retries, 'Error' in parsed)
+
+
+def __after_call_error(context, **_):
+    if _START_KEY not in context:
+        return
+    start, stats = context.pop(_START_KEY)
+    with _STATS_LOCK:
+        stats.add_call(time.perf_counter() - start, 0, True)
+
+
+def __response_received(parsed_response=None, context=None, **_):
+    """
+    Count a throttled attempt, the response of every attempt is received, including those botocore retries
+    """
+    if parsed_response and context and _START_KEY in context and \
+            parsed_response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+        stats = context[_START_KEY][1]
+        with _STATS_LOCK:
+            stats.throttles += 1
+
+
+def record_cache(name, hit):
+    """
+    Record a cache lookup
+    :param name: Cache name, usually service.operation of the call it saves
+    :param hit: True if the value came from the cache
+    """
+    with _STATS_LOCK:
+        counters = _CACHES.setdefault(name, [0, 0])
+        counters[0 if hit else 1] += 1
+
+
+def get_cache_report():
+    """
+    Get the recorded cache lookups, sorted by cache name
+    :return: List of dictionaries, one per cache
+    """
+    with _STATS_LOCK:
+        return [dict(cache=name, hits=hits, misses=misses) for name, (hits, misses) in sorted(_CACHES.items())]
+
+
+def get_report():
+    """
+    Get the recorded counters, sorted by service and operation
+    :return: List of dictionaries, one per operation
+    """
+    with _STATS_LOCK:
+        return [stats.as_dict() for _, stats in sorted(_STATS.items())]
+
+
+def echo_report():
+    """
+    Log the API call report table
+    """
+    report = get_report()
+    if report:
+        lines = ['%-45s %6s %7s %9s %6s %10s %10s' % ('Operation', 'Calls', 'Retries', 'Throttles', 'Errors',
+                                                    'Avg (ms)', 'Max (ms)')]
+        for row in report:
+            lines.append('%-45s %6d %7d %9d %6d %10.1f %10.1f' % (
+                row['service'] + '.' + row['operation'], row['calls'], row['retries'], row['throttles'],
+                row['errors'], row['total_latency'] / row['calls'] * 1000 if row['calls'] else 0,
+                row['max_latency'] * 1000))
+        lines.append('Total calls: %d' % sum(row['calls'] for row in report))
+        log.echo_info('AWS API calls:\n' + '\n'.join(lines))
+    cache_report = get_cache_report()
+    if cache_report:
+        lines = ['%-45s %12s %8s' % ('Cache', 'Calls saved', 'Misses')]
+        for row in cache_report:
+            lines.append('%-45s %12d %8d' % (row['cache'], row['hits'], row['misses']))
+        log.echo_info('Cached AWS lookups:\n' + '\n'.join(lines))
+
+
+def write_report(file_name):
+    """
+    Write the API call report as JSON
+    :param file_name: Report file name
+    """
+    with open(file_name, 'w') as report_file:
+        json.dump(dict(operations=get_report(), caches=get_cache_report()), report_file, indent=2)
+    log.echo_info('AWS API call report written to %s', file_name)
+
+
+def reset():
+    """
+    Clear the recorded counters
+    """
+    with _STATS_LOCK:
+        _STATS.clear()
+        _CACHES.clear()
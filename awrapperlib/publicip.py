@@ -0,0 +1,105 @@
+"""
+Public IP discovery.
+
+The public IP of this host is resolved once and kept in memory and in the disk cache for public_ip_ttl
+seconds. A lookup queries every configured endpoint concurrently and takes the first valid answer, so one
+slow or unreachable service doesn't stall the run. The public_ip property, the AW_PUBLIC_IP environment
+variable or set_resolver() replace the HTTP lookup, e.g. offline or in tests.
+"""
+
+import ipaddress
+import os
+import queue
+import threading
+import time
+from awrapperlib import cache, metrics, logger as log
+
+DEFAULT_ENDPOINTS = ['http://ip.42.pl/raw', 'https://checkip.amazonaws.com', 'https://api.ipify.org']
+DEFAULT_TIMEOUT = 3
+DEFAULT_TTL = 300
+PUBLIC_IP_ENV = 'AW_PUBLIC_IP'
+CONFIG_PROPERTIES = ['public_ip', 'public_ip_endpoints', 'public_ip_timeout', 'public_ip_ttl']
+
+_PROVIDER = dict(settings={}, resolver=None, ip=None, expires=0)
+_PROVIDER_LOCK = threading.Lock()
+
+
+def configure(**kwargs):
+    """
+    Set the public IP lookup options, the cached IP is dropped when they change
+    :param kwargs: Dictionary containing the properties file options (public_ip, public_ip_endpoints,
+    public_ip_timeout, public_ip_ttl)
+    """
+    settings = {prop: kwargs[prop] for prop in CONFIG_PROPERTIES if prop in kwargs}
+    with _PROVIDER_LOCK:
+        if _PROVIDER['settings'] != settings:
+            _PROVIDER['settings'] = settings
+            _PROVIDER['ip'] = None
+
+
+def set_resolver(resolver):
+    """
+    Replace the HTTP lookup, results of the resolver are not cached
+    :param resolver: Callable returning the public IP as a string, None to restore the HTTP lookup
+    """
+    with _PROVIDER_LOCK:
+        _PROVIDER['resolver'] = resolver
+
+
+def get_public_ip():
+    """
+    Get the public IP of this host
+    :return: String public IP, without prefix length
+    """
+    with _PROVIDER_LOCK:
+        settings = dict(_PROVIDER['settings'])
+        resolver = _PROVIDER['resolver']
+        cached_ip = _PROVIDER['ip'] if _PROVIDER['expires'] > time.time() else None
+    static_ip = settings.get('public_ip') or os.environ.get(PUBLIC_IP_ENV)
+    if static_ip:
+        return static_ip
+    if resolver is not None:
+        return resolver()
+    ttl = float(settings.get('public_ip_ttl', DEFAULT_TTL))
+    if cached_ip is None:
+        cached_ip = cache.DiskCache('public_ip', ttl=ttl).get('ip')
+    metrics.record_cache('public_ip', cached_ip is not None)
+    if cached_ip is None:
+        cached_ip = __resolve(__get_endpoints(settings), float(settings.get('public_ip_timeout', DEFAULT_TIMEOUT)))
+        cache.DiskCache('public_ip', ttl=ttl).set('ip', cached_ip)
+    with _PROVIDER_LOCK:
+        _PROVIDER['ip'] = cached_ip
+        _PROVIDER['expires'] = time.time() + ttl
+    return cached_ip
+
+
+def __get_endpoints(settings):
+    if 'public_ip_endpoints' not in settings:
+        return DEFAULT_ENDPOINTS
+    return [endpoint.strip() for endpoint in settings['public_ip_endpoints'].split(',') if endpoint.strip()]
+
+
+def __resolve(endpoints, timeout):
+    answers = queue.Queue()
+    for endpoint in endpoints:
+        threading.Thread(target=__query, args=(endpoint, timeout, answers), daemon=True).start()
+    deadline = time.time() + timeout
+    for _ in endpoints:
+        try:
+            endpoint, answer = answers.get(timeout=max(0, deadline - time.time()))
+        except queue.Empty:
+            break
+        if answer is not None:
+            log.echo_debug('Public IP %s from %s', answer, endpoint)
+            return answer
+    raise IOError('Unable to get the public IP from %s within %s seconds' % (', '.join(endpoints), timeout))
+
+
+def __query(endpoint, timeout, answers):
+    from urllib.request import urlopen
+    try:
+        answer = urlopen(endpoint, timeout=timeout).read().decode('utf-8').strip()
+        answers.put((endpoint, str(ipaddress.IPv4Address(answer))))
+    except Exception as e:
+        log.echo_debug('Public IP lookup on %s failed: %s', endpoint, e)
+        answers.put((endpoint, None))
@@ -0,0 +1,362 @@
+"""
+Pipelined, resumable SFTP upload and delta sync.
+
+Files are written to a remote '.part' file with pipelined SFTP writes over a channel with a large
+window, the local offset is checkpointed so an interrupted upload resumes where it stopped, and the
+remote SHA-256 is compared with the local one before the '.part' file is renamed into place.
+
+sync() skips the upload when the remote file already has the same SHA-256 and otherwise sends an
+rsync-style delta: a small Python helper run on the instance returns the block signatures of the
+remote file, the local file is scanned with a rolling checksum, and only the blocks the remote file
+doesn't have cross the wire.
+"""
+
+import base64
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import time
+import zlib
+from awrapperlib import logger as log
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_WINDOW_SIZE = 16 * 1024 * 1024
+DEFAULT_MAX_PACKET_SIZE = 512 * 1024
+DEFAULT_CHECKPOINT_INTERVAL = 8 * 1024 * 1024
+DEFAULT_PROGRESS_INTERVAL = 5
+DEFAULT_CHECKPOINT_DIR = os.path.join(os.path.expanduser('~'), '.aw-wrapper', 'transfers')
+PART_SUFFIX = '.part'
+DELTA_MIN_BLOCK_SIZE = 2048
+DELTA_MAX_BLOCK_SIZE = 65536
+DELTA_MAX_SCAN = 16 * 1024 * 1024
+DELTA_SAMPLE_SIZE = 1024 * 1024
+DELTA_MAX_LITERAL_RATIO = 0.5
+DELTA_MAX_LITERAL = 1024 * 1024
+DELTA_OP_COPY = 0
+DELTA_OP_LITERAL = 1
+_ADLER_MOD = 65521
+_SIGNATURE = struct.Struct('>I16s')
+_DELTA_OP = struct.Struct('>BI')
+_REMOTE_HELPER = r"""
+import hashlib, struct, sys, zlib
+mode, path, block = sys.argv[1], sys.argv[2], int(sys.argv[3])
+out = getattr(sys.stdout, 'buffer', sys.stdout)
+inp = getattr(sys.stdin, 'buffer', sys.stdin)
+old = open(path, 'rb')
+if mode == 'sig':
+    while True:
+        data = old.read(block)
+        if not data:
+            break
+        out.write(struct.pack('>I16s', zlib.adler32(data) & 0xffffffff, hashlib.md5(data).digest()))
+else:
+    new = open(path + '.part', 'wb')
+    while True:
+        header = inp.read(5)
+        if len(header) < 5:
+            break
+        op, value = struct.unpack('>BI', header)
+        if op == 0:
+            old.seek(value * block)
+            new.write(old.read(block))
+        else:
+            while value:
+                data = inp.read(min(value, 1048576))
+                if not data:
+                    sys.exit(2)
+                new.write(data)
+                value -= len(data)
+    new.close()
+out.flush()
+"""
+
+
+def open_sftp(ssh_client, window_size=DEFAULT_WINDOW_SIZE, max_packet_size=DEFAULT_MAX_PACKET_SIZE):
+    """
+    Open a SFTP session with a large channel window
+    :param ssh_client: Connected SSHClient
+    :param window_size: SSH channel window size in bytes
+    :param max_packet_size: SSH channel maximum packet size in bytes
+    :return: SFTPClient instance
+    """
+    import paramiko
+    return paramiko.SFTPClient.from_transport(ssh_client.get_transport(), window_size=window_size,
+                                              max_packet_size=max_packet_size)
+
+
+def remote_sha256(ssh_client, remote_path):
+    """
+    Get the SHA-256 of a remote file
+    :param ssh_client: Connected SSHClient
+    :param remote_path: Remote file path
+    :return: Hex digest, None if the file doesn't exist or sha256sum is not available
+    """
+    _, stdout, _ = ssh_client.exec_command("sha256sum '%s'" % remote_path.replace("'", "'\\''"))
+    output = stdout.read().decode('utf-8').split()
+    if stdout.channel.recv_exit_status() != 0 or not output:
+        return None
+    return output[0]
+
+
+def __get_checkpoint_file(ssh_client, remote_path, checkpoint_dir):
+    host = ssh_client.get_transport().getpeername()[0]
+    key = hashlib.sha1(('%s:%s' % (host, remote_path)).encode('utf-8')).hexdigest()
+    return os.path.join(checkpoint_dir, key + '.json')
+
+
+def __read_checkpoint(checkpoint_file, local_path, local_stat):
+    try:
+        with open(checkpoint_file) as checkpoint:
+            data = json.load(checkpoint)
+    except (IOError, ValueError):
+        return 0
+    if data.get('local_path') != os.path.abspath(local_path) or data.get('size') != local_stat.st_size or \
+            data.get('mtime') != local_stat.st_mtime:
+        return 0
+    return data.get('offset', 0)
+
+
+def __write_checkpoint(checkpoint_file, local_path, local_stat, offset):
+    os.makedirs(os.path.dirname(checkpoint_file), exist_ok=True)
+    with open(checkpoint_file, 'w') as checkpoint:
+        json.dump(dict(local_path=os.path.abspath(local_path), size=local_stat.st_size, mtime=local_stat.st_mtime,
+                       offset=offset), checkpoint)
+
+
+def __get_resume_offset(sftp_client, part_path, checkpoint_offset):
+    if not checkpoint_offset:
+        return 0
+    try:
+        return min(sftp_client.stat(part_path).st_size, checkpoint_offset)
+    except IOError:
+        return 0
+
+
+def upload(ssh_client, local_path, remote_path, chunk_size=DEFAULT_CHUNK_SIZE, checkpoint_dir=DEFAULT_CHECKPOINT_DIR):
+    """
+    Upload a file, resuming a previous interrupted upload of the same file
+    :param ssh_client: Connected SSHClient
+    :param local_path: Local file path
+    :param remote_path: Remote file path
+    :param chunk_size: Bytes read and written per request
+    :param checkpoint_dir: Directory of the local checkpoint files
+    :return: SHA-256 hex digest of the uploaded file
+    """
+    local_stat = os.stat(local_path)
+    part_path = remote_path + PART_SUFFIX
+    checkpoint_file = __get_checkpoint_file(ssh_client, remote_path, checkpoint_dir)
+    sftp_client = open_sftp(ssh_client)
+    try:
+        offset = __get_resume_offset(sftp_client, part_path,
+                                     __read_checkpoint(checkpoint_file, local_path, local_stat))
+        digest = hashlib.sha256()
+        with open(local_path, 'rb') as local_file:
+            if offset:
+                log.echo_info('Resuming upload of %s at %d of %d bytes' % (local_path, offset, local_stat.st_size))
+                remaining = offset
+                while remaining:
+                    data = local_file.read(min(chunk_size, remaining))
+                    digest.update(data)
+                    remaining -= len(data)
+            with sftp_client.open(part_path, 'r+b' if offset else 'wb') as remote_file:
+                remote_file.set_pipelined(True)
+                remote_file.seek(offset)
+                offset = __copy(local_file, remote_file, digest, offset, local_path, local_stat,
+                                checkpoint_file, chunk_size)
+        local_digest = digest.hexdigest()
+        remote_digest = remote_sha256(ssh_client, part_path)
+        if remote_digest is not None and remote_digest != local_digest:
+            sftp_client.remove(part_path)
+            if os.path.exists(checkpoint_file):
+                os.remove(checkpoint_file)
+            raise IOError('Checksum mismatch uploading %s: local %s remote %s' % (local_path, local_digest,
+                                                                                 remote_digest))
+        if remote_digest is None:
+            log.echo_warning('sha256sum not available on the instance, checksum not verified')
+        sftp_client.posix_rename(part_path, remote_path)
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        return local_digest
+    finally:
+        sftp_client.close()
+
+
+def __copy(local_file, remote_file, digest, offset, local_path, local_stat, checkpoint_file, chunk_size):
+    start = time.time()
+    start_offset = offset
+    next_checkpoint = offset + DEFAULT_CHECKPOINT_INTERVAL
+    next_progress = start + DEFAULT_PROGRESS_INTERVAL
+    while True:
+        data = local_file.read(chunk_size)
+        if not data:
+            break
+        remote_file.write(data)
+        digest.update(data)
+        offset += len(data)
+        if offset >= next_checkpoint:
+            __write_checkpoint(checkpoint_file, local_path, local_stat, offset)
+            next_checkpoint = offset + DEFAULT_CHECKPOINT_INTERVAL
+        if time.time() >= next_progress:
+            __log_throughput(local_path, offset, local_stat.st_size, offset - start_offset, time.time() - start)
+            next_progress = time.time() + DEFAULT_PROGRESS_INTERVAL
+    remote_file.flush()
+    __log_throughput(local_path, offset, local_stat.st_size, offset - start_offset, time.time() - start)
+    return offset
+
+
+def __log_throughput(local_path, offset, size, sent, elapsed):
+    log.echo_info('Uploaded %s %d/%d bytes (%.0f%%) at %.2f MB/s' % (
+        os.path.basename(local_path), offset, size, 100.0 * offset / size if size else 100,
+        sent / 1048576.0 / elapsed if elapsed else 0))
+
+
+def file_sha256(local_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Get the SHA-256 of a local file
+    :param local_path: Local file path
+    :param chunk_size: Bytes read at a time
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(local_path, 'rb') as local_file:
+        for data in iter(lambda: local_file.read(chunk_size), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def sync(ssh_client, local_path, remote_path):
+    """
+    Make the remote file identical to the local one, skipping the upload when the content hash matches
+    and sending only the changed blocks when an older version exists
+    :param ssh_client: Connected SSHClient
+    :param local_path: Local file path
+    :param remote_path: Remote file path
+    :return: SHA-256 hex digest of the file
+    """
+    local_digest = file_sha256(local_path)
+    remote_digest = remote_sha256(ssh_client, remote_path)
+    if remote_digest == local_digest:
+        log.echo_info('%s is up to date on the instance, upload skipped' % os.path.basename(local_path))
+        return local_digest
+    if remote_digest is not None and os.path.getsize(local_path) > 0:
+        try:
+            if __delta_upload(ssh_client, local_path, remote_path, local_digest):
+                return local_digest
+        except (IOError, OSError) as error:
+            log.echo_warning('Delta sync failed, uploading the whole file: %s' % error)
+    return upload(ssh_client, local_path, remote_path)
+
+
+def __get_block_size(size):
+    return max(DELTA_MIN_BLOCK_SIZE, min(DELTA_MAX_BLOCK_SIZE, int(math.sqrt(size))))
+
+
+def __run_remote_helper(ssh_client, mode, remote_path, block_size, payload=None):
+    source = base64.b64encode(_REMOTE_HELPER.encode('utf-8')).decode('ascii')
+    command = ("PY=$(command -v python3 || command -v python) && exec \"$PY\" -c "
+               "\"import base64; exec(base64.b64decode('%s'))\" %s '%s' %d" %
+               (source, mode, remote_path.replace("'", "'\\''"), block_size))
+    stdin, stdout, _ = ssh_client.exec_command(command)
+    if payload is not None:
+        for data in payload:
+            stdin.write(data)
+    stdin.channel.shutdown_write()
+    output = stdout.read()
+    if stdout.channel.recv_exit_status() != 0:
+        return None
+    return output
+
+
+def __get_remote_signatures(ssh_client, remote_path, block_size):
+    output = __run_remote_helper(ssh_client, 'sig', remote_path, block_size)
+    if output is None:
+        return None
+    signatures = {}
+    for index in range(len(output) // _SIGNATURE.size):
+        weak, strong = _SIGNATURE.unpack_from(output, index * _SIGNATURE.size)
+        signatures.setdefault(weak, {}).setdefault(strong, index)
+    return signatures
+
+
+def __compute_delta(data, signatures, block_size, stats):
+    """
+    Scan the local data with a rolling Adler-32 and yield the copy/literal operations. The scan stops and sets
+    stats['aborted'] once more than DELTA_MAX_LITERAL_RATIO of the bytes scanned are literal
+    """
+    size = len(data)
+    position = 0
+    literal_start = 0
+    scanned = 0
+    weak = None
+    while position + block_size <= size and scanned < DELTA_MAX_SCAN:
+        if weak is None:
+            weak = zlib.adler32(data[position:position + block_size]) & 0xffffffff
+        candidates = signatures.get(weak)
+        if candidates:
+            index = candidates.get(hashlib.md5(data[position:position + block_size]).digest())
+            if index is not None:
+                for operation in __literal_ops(data, literal_start, position, stats):
+                    yield operation
+                stats['copied'] += block_size
+                yield _DELTA_OP.pack(DELTA_OP_COPY, index)
+                position += block_size
+                literal_start = position
+                weak = None
+                continue
+        if position + block_size < size:
+            byte_out = data[position]
+            a = ((weak & 0xffff) - byte_out + data[position + block_size]) % _ADLER_MOD
+            b = ((weak >> 16) - block_size * byte_out + a - 1) % _ADLER_MOD
+            weak = (b << 16) | a
+        position += 1
+        scanned += 1
+        if scanned % DELTA_SAMPLE_SIZE == 0 and scanned > position * DELTA_MAX_LITERAL_RATIO:
+            stats['aborted'] = True
+            return
+    for operation in __literal_ops(data, literal_start, size, stats):
+        yield operation
+
+
+def __literal_ops(data, start, end, stats):
+    while start < end:
+        length = min(DELTA_MAX_LITERAL, end - start)
+        stats['literal'] += length
+        yield _DELTA_OP.pack(DELTA_OP_LITERAL, length) + data[start:start + length]
+        start += length
+
+
+def __delta_upload(ssh_client, local_path, remote_path, local_digest):
+    size = os.path.getsize(local_path)
+    block_size = __get_block_size(size)
+    signatures = __get_remote_signatures(ssh_client, remote_path, block_size)
+    if signatures is None:
+        log.echo_warning('Python not available on the instance, delta sync skipped')
+        return False
+    stats = dict(copied=0, literal=0, aborted=False)
+    start = time.time()
+    with open(local_path, 'rb') as local_file:
+        data = mmap.mmap(local_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            output = __run_remote_helper(ssh_client, 'patch', remote_path, block_size,
+                                         __compute_delta(data, signatures, block_size, stats))
+        finally:
+            data.close()
+    if stats['aborted']:
+        log.echo_info('%s is mostly new data, uploading the whole file' % os.path.basename(local_path))
+        return False
+    part_path = remote_path + PART_SUFFIX
+    if output is None or remote_sha256(ssh_client, part_path) != local_digest:
+        log.echo_warning('Delta sync of %s produced a different file' % os.path.basename(local_path))
+        return False
+    sftp_client = open_sftp(ssh_client)
+    try:
+        sftp_client.posix_rename(part_path, remote_path)
+    finally:
+        sftp_client.close()
+    log.echo_info('Delta synced %s: %d bytes sent, %d bytes reused (%.0f%%) in %.1fs' % (
+        os.path.basename(local_path), stats['literal'], stats['copied'], 100.0 * stats['copied'] / size,
+        time.time() - start))
+    return True
@@ -1,10 +1,11 @@
 import csv
 from awrapperlib import aw, resource, logger as log
-from services import ec2 as ec2_service
 
-VALID_OPTIONS = ['ec2', 'list']
-VALID_LIST_OPTIONS = ['types', 'key_pairs', 'security_groups', 'regions']
-VALID_EC2_OPTIONS = ['name', 'type', 'region', 'user_data', 'security_group', 'key_pair', 'key_path', 'deploy']
+VALID_OPTIONS = ['ec2', 'list', 'daemon', 'bake']
+VALID_LIST_OPTIONS = ['types', 'key_pairs', 'security_groups', 'regions', 'resources']
+VALID_DAEMON_OPTIONS = ['stop']
+VALID_EC2_OPTIONS = ['name', 'type', 'region', 'user_data', 'security_group', 'key_pair', 'key_path', 'deploy',
+                     'count', 'min_count', 'deploy_workers', 'deploy_timeout', 'warm_pool_size']
 VALID_INIT_SCRIPT = ['tomcat']
 
 
@@ -17,10 +18,12 @@ def validate_options(arg, **kwargs):
     """
     _valid = False
     if arg[0] in VALID_OPTIONS:
-        if 'ec2' == arg[0]:
+        if 'ec2' == arg[0] or 'bake' == arg[0]:
             _valid = validate_ec2(**kwargs)
         elif 'list' == arg[0]:
             _valid = validate_list(arg, dict(region=kwargs['region']))
+        elif 'daemon' == arg[0]:
+            _valid = validate_daemon(arg)
     if _valid:
         return
     else:
@@ -52,12 +55,26 @@ def validate_list(arg, args):
     return _valid
 
 
+def validate_daemon(arg):
+    """
+    Check daemon options are valid, see valid options in $VALID_DAEMON_OPTIONS
+    :param arg: Daemon option to validate, none to start the daemon
+    :return: True if validation was successful else return False
+    """
+    _valid = True
+    if len(arg) > 1 and arg[1] not in VALID_DAEMON_OPTIONS:
+        _valid = False
+        log.echo_error("'%s' is not a valid option" % arg[1])
+    return _valid
+
+
 def validate_ec2(args):
     """
     Check ec2 options are valid, see valid options in $VALID_EC2_OPTIONS
     :param args: Dictionary containing the properties file options
     :return: True if validation was successful else return False
     """
+    from services import ec2 as ec2_service
     _valid = True
     ec2 = ec2_service.Ec2Helper()
     for key in args:
@@ -78,12 +95,12 @@ def validate_ec2(args):
                 _valid = False
                 log.echo_error("Invalid Region '" + args[key] + "' , run 'list regions' to see valid options")
         if key == 'security_group':
-            if args[key] not in ec2.get_security_groups(''):
+            if not ec2.security_group_id_exists(args[key]):
                 _valid = False
                 log.echo_error(
                     "Invalid Security Group '" + args[key] + "' , run 'list security_groups' to see valid options")
         if key == 'key_pair':
-            if args[key] not in ec2.get_key_pairs():
+            if not ec2.key_pair_exists(args[key]):
                 _valid = False
                 log.echo_error("Invalid Key Pair '" + args[key] + "' , run 'list key_pairs' to see valid options")
             try:
@@ -0,0 +1,254 @@
+"""
+Multiplexed waiter engine.
+
+Tracks any number of pending EC2, RDS and DMS resources. Every tick issues one batched describe call
+per resource kind and region, resolves the future of each resource that reached a ready or failure
+state, and sleeps with exponential backoff and jitter before the next tick.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import Future
+from botocore.exceptions import ClientError
+from awrapperlib import clients, logger as log
+
+EC2_INSTANCE = 'ec2_instance'
+EC2_INSTANCE_STATE = 'ec2_instance_state'
+EC2_IMAGE = 'ec2_image'
+RDS_INSTANCE = 'rds_instance'
+DMS_REPLICATION_INSTANCE = 'dms_replication_instance'
+DMS_REPLICATION_TASK = 'dms_replication_task'
+DMS_CONNECTION = 'dms_connection'
+EC2_MAX_IDS_PER_CALL = 100
+
+
+def __describe_ec2_batch(describe, ids):
+    """
+    Call describe on ids, splitting the batch when EC2 rejects it for an unknown Id so that one instance not
+    visible yet doesn't hide the others
+    :param describe: Callable taking a list of instance Ids and returning the response
+    :param ids: List of instance Ids, at most EC2_MAX_IDS_PER_CALL
+    :return: List of responses
+    """
+    try:
+        return [describe(ids)]
+    except ClientError as error:
+        if len(ids) == 1 or not error.response['Error']['Code'].startswith('InvalidInstanceID'):
+            log.echo_debug('EC2 instances not visible yet: %s', error)
+            return []
+    middle = len(ids) // 2
+    return __describe_ec2_batch(describe, ids[:middle]) + __describe_ec2_batch(describe, ids[middle:])
+
+
+def __describe_ec2_instances(ids, region):
+    client = clients.get_client('ec2', region)
+    statuses = {}
+    for index in range(0, len(ids), EC2_MAX_IDS_PER_CALL):
+        responses = __describe_ec2_batch(
+            lambda batch: client.describe_instance_status(InstanceIds=batch, IncludeAllInstances=True),
+            ids[index:index + EC2_MAX_IDS_PER_CALL])
+        for response in responses:
+            for status in response['InstanceStatuses']:
+                statuses[status['InstanceId']] = status['SystemStatus']['Status']
+    return statuses
+
+
+def __describe_ec2_instance_states(ids, region):
+    client = clients.get_client('ec2', region)
+    states = {}
+    for index in range(0, len(ids), EC2_MAX_IDS_PER_CALL):
+        responses = __describe_ec2_batch(lambda batch: client.describe_instances(InstanceIds=batch),
+                                         ids[index:index + EC2_MAX_IDS_PER_CALL])
+        for response in responses:
+            for reservation in response['Reservations']:
+                for instance in reservation['Instances']:
+                    states[instance['InstanceId']] = instance['State']['Name']
+    return states
+
+
+def __describe_ec2_images(ids, region):
+    client = clients.get_client('ec2', region)
+    states = {}
+    for index in range(0, len(ids), EC2_MAX_IDS_PER_CALL):
+        filters = [dict(Name='image-id', Values=ids[index:index + EC2_MAX_IDS_PER_CALL])]
+        response = client.describe_images(Filters=filters)
+        for image in response['Images']:
+            states[image['ImageId']] = image['State']
+    return states
+
+
+def __describe_rds_instances(ids, region):
+    paginator = clients.get_client('rds', region).get_paginator('describe_db_instances')
+    statuses = {}
+    for page in paginator.paginate(Filters=[dict(Name='db-instance-id', Values=ids)]):
+        for instance in page['DBInstances']:
+            statuses[instance['DBInstanceIdentifier']] = instance['DBInstanceStatus']
+    return statuses
+
+
+def __describe_dms_replication_instances(ids, region):
+    paginator = clients.get_client('dms', region).get_paginator('describe_replication_instances')
+    statuses = {}
+    for page in paginator.paginate(Filters=[dict(Name='replication-instance-arn', Values=ids)]):
+        for instance in page['ReplicationInstances']:
+            statuses[instance['ReplicationInstanceArn']] = instance['ReplicationInstanceStatus']
+    return statuses
+
+
+def __describe_dms_replication_tasks(ids, region):
+    paginator = clients.get_client('dms', region).get_paginator('describe_replication_tasks')
+    statuses = {}
+    for page in paginator.paginate(Filters=[dict(Name='replication-task-arn', Values=ids)], WithoutSettings=True):
+        for task in page['ReplicationTasks']:
+            statuses[task['ReplicationTaskArn']] = task['Status']
+    return statuses
+
+
+def __describe_dms_connections(ids, region):
+    paginator = clients.get_client('dms', region).get_paginator('describe_connections')
+    connections = {}
+    for page in paginator.paginate(Filters=[dict(Name='replication-instance-arn', Values=ids)]):
+        for connection in page['Connections']:
+            connections.setdefault(connection['ReplicationInstanceArn'], []).append(connection['Status'])
+    statuses = {}
+    for arn, connection_statuses in connections.items():
+        if 'failed' in connection_statuses:
+            statuses[arn] = 'failed'
+        elif all(status == 'successful' for status in connection_statuses):
+            statuses[arn] = 'successful'
+        else:
+            statuses[arn] = 'testing'
+    return statuses
+
+
+DESCRIBERS = {
+    EC2_INSTANCE: __describe_ec2_instances,
+    EC2_INSTANCE_STATE: __describe_ec2_instance_states,
+    EC2_IMAGE: __describe_ec2_images,
+    RDS_INSTANCE: __describe_rds_instances,
+    DMS_REPLICATION_INSTANCE: __describe_dms_replication_instances,
+    DMS_REPLICATION_TASK: __describe_dms_replication_tasks,
+    DMS_CONNECTION: __describe_dms_connections,
+}
+
+
+class _PendingResource:
+    """
+    Resource waiting to reach a ready state
+    """
+    def __init__(self, kind, resource_id, region, ready_states, failure_states, timeout):
+        self.kind = kind
+        self.resource_id = resource_id
+        self.region = region
+        self.ready_states = ready_states
+        self.failure_states = failure_states
+        self.deadline = time.time() + timeout
+        self.future = Future()
+
+
+class WaiterEngine:
+    """
+    Waits for many resources at once from a background thread
+    """
+    DEFAULT_BASE_DELAY = 2
+    DEFAULT_MAX_DELAY = 30
+    DEFAULT_TIMEOUT = 600
+
+    def __init__(self, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.pending = []
+        self.attempt = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def register(self, kind, resource_id, region, ready_states, failure_states=(), timeout=DEFAULT_TIMEOUT,
+                 callback=None):
+        """
+        Start waiting for a resource
+        :param kind: Resource kind, one of DESCRIBERS
+        :param resource_id: Resource Id (instance id, identifier or ARN, depending on the kind)
+        :param region: Region name
+        :param ready_states: States in which the resource is ready
+        :param failure_states: States in which the resource will never be ready
+        :param timeout: Seconds to wait before giving up
+        :param callback: Function called with (resource_id, ready) when the wait finishes
+        :return: Future resolved to True when ready, False on failure or timeout
+        """
+        assert kind in DESCRIBERS, 'Unsupported resource kind %s' % kind
+        pending = _PendingResource(kind, resource_id, region, ready_states, failure_states, timeout)
+        if callback:
+            pending.future.add_done_callback(lambda future: callback(resource_id, future.result()))
+        with self.condition:
+            self.pending.append(pending)
+            self.attempt = 0
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.__run, name='aw-waiter', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return pending.future
+
+    def wait(self, kind, resource_id, region, ready_states, failure_states=(), timeout=DEFAULT_TIMEOUT):
+        """
+        Wait for a single resource
+        :return: True when ready, False on failure or timeout
+        """
+        return self.register(kind, resource_id, region, ready_states, failure_states, timeout).result()
+
+    def __run(self):
+        while True:
+            with self.condition:
+                if not self.pending:
+                    self.thread = None
+                    return
+                pending = list(self.pending)
+            self.__tick(pending)
+            with self.condition:
+                if self.pending:
+                    self.condition.wait(self.__get_delay())
+                    self.attempt += 1
+
+    def __get_delay(self):
+        delay = min(self.max_delay, self.base_delay * 2 ** self.attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def __tick(self, pending):
+        groups = {}
+        for resource in pending:
+            groups.setdefault((resource.kind, resource.region), []).append(resource)
+        for (kind, region), resources in groups.items():
+            ids = sorted(set(resource.resource_id for resource in resources))
+            try:
+                statuses = DESCRIBERS[kind](ids, region)
+            except Exception as error:
+                log.echo_warning('Describe %s failed, retrying: %s', kind, error)
+                statuses = {}
+            for resource in resources:
+                self.__check(resource, statuses.get(resource.resource_id))
+
+    def __check(self, resource, status):
+        if status in resource.ready_states:
+            ready = True
+        elif status in resource.failure_states:
+            log.echo_error('%s %s failed with status %s', resource.kind, resource.resource_id, status)
+            ready = False
+        elif time.time() > resource.deadline:
+            log.echo_error('Timeout waiting for %s %s, last status %s', resource.kind, resource.resource_id, status)
+            ready = False
+        else:
+            return
+        with self.condition:
+            self.pending.remove(resource)
+        resource.future.set_result(ready)
+
+
+_ENGINE = WaiterEngine()
+
+
+def get_engine():
+    """
+    Get the process-wide waiter engine
+    :return: WaiterEngine instance
+    """
+    return _ENGINE
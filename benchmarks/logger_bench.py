@@ -0,0 +1,109 @@
+"""
+Micro-benchmark of the echo_* caller lookup and message formatting.
+
+Compares the per-call cost of the current awrapperlib.logger implementation against the previous
+inspect.stack() based one, for an enabled echo_info and for an echo_debug filtered out at INFO level.
+Run from the project root:
+
+    python benchmarks/logger_bench.py [iterations]
+"""
+
+import inspect
+import logging
+import math
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from awrapperlib import logger as log  # noqa: E402
+
+DEFAULT_ITERATIONS = 2000
+SAMPLE_MESSAGE = 'Calling command-line: <<<%s>>>\nstdout line\r\nstderr line {scriptname}' % ('x' * 80)
+
+
+def _legacy_get_echo_caller():
+    try:
+        stack_level = 1
+        frame = inspect.stack()[stack_level]
+        frame_module = frame[1]
+        frame_method = frame[3]
+        while not (str(frame_module).endswith('aw.py') and
+                   str(frame_method).startswith('echo_')) and stack_level < 10:
+            stack_level += 1
+            frame = inspect.stack()[stack_level]
+            frame_module = frame[1]
+            frame_method = frame[3]
+        frame = inspect.stack()[stack_level + 1]
+        frame_module = frame[1]
+        frame_line = frame[2]
+    except Exception or BaseException:
+        frame_module = log.SCRIPT_NAME
+        frame_line = '---'
+    index_start = str(frame_module).rfind(os.path.sep)
+    index_end = str(frame_module).rfind('.')
+    return frame_module[index_start + 1:index_end], frame_line
+
+
+def _legacy_get_echo_msg(msg, log_level):
+    if isinstance(msg, str):
+        if r'{timestamp}' in msg.lower():
+            timestamp = math.floor(time.time())
+            msg = msg.replace('{timestamp}', '%d' % timestamp)
+        if r'{scriptname}' in msg.lower():
+            msg = msg.replace('{scriptname}', log.SCRIPT_NAME)
+    caller_name, caller_line = _legacy_get_echo_caller()
+    return '%-27s %-5s %-7s %s' % (caller_name, caller_line, log_level, msg)
+
+
+def _legacy_wrap_long_lines(msg):
+    return_msg = msg
+    if '\n' in msg or '\r' in msg or '\r\n' in msg:
+        if '\r\n' in return_msg:
+            return_msg = return_msg.replace('\r\n', '~!@#$%^&*' + ' ' * log.LOG_INDENT)
+        if '\n' in return_msg:
+            return_msg = return_msg.replace('\n', '~!@#$%^&*' + ' ' * log.LOG_INDENT)
+        if '\r' in return_msg:
+            return_msg = return_msg.replace('\r', '~!@#$%^&*' + ' ' * log.LOG_INDENT)
+        return return_msg.replace('~!@#$%^&*', '\n')
+    return msg
+
+
+def legacy_echo_info(msg):
+    log.LOGGER.info(_legacy_get_echo_msg(_legacy_wrap_long_lines(msg), 'INFO'))
+
+
+def legacy_echo_debug(msg):
+    log.LOGGER.debug(_legacy_get_echo_msg(_legacy_wrap_long_lines(msg), 'DEBUG'))
+
+
+def _per_call_usec(func, iterations):
+    """
+    Get the best per-call cost of a function
+    :param func: Function to time
+    :param iterations: Number of calls per repetition
+    :return: Microseconds per call
+    """
+    timings = timeit.repeat(lambda: func(SAMPLE_MESSAGE), number=iterations, repeat=3)
+    return min(timings) / iterations * 1e6
+
+
+def main(argv):
+    iterations = int(argv[1]) if len(argv) > 1 else DEFAULT_ITERATIONS
+    logging.basicConfig(level=logging.INFO, stream=open(os.devnull, 'w'))
+    legacy = _per_call_usec(legacy_echo_info, iterations)
+    current = _per_call_usec(log.echo_info, iterations)
+    print('%-20s %12s' % ('implementation', 'usec/call'))
+    print('%-20s %12.2f' % ('inspect.stack()', legacy))
+    print('%-20s %12.2f' % ('frame walk', current))
+    print('speedup x%.1f' % (legacy / current))
+    legacy_debug = _per_call_usec(legacy_echo_debug, iterations)
+    current_debug = _per_call_usec(lambda msg: log.echo_debug('%s', msg), iterations)
+    print('%-20s %12.2f' % ('debug at INFO, old', legacy_debug))
+    print('%-20s %12.2f' % ('debug at INFO, lazy', current_debug))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,84 @@
+"""
+Cold-start benchmark of the main.py CLI subcommands.
+
+For every subcommand a fresh interpreter imports main plus the modules its Switcher method loads,
+under python -X importtime, and the median wall time and the slowest imports are reported. Run from
+the project root:
+
+    python benchmarks/startup_bench.py [runs] [top]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_RUNS = 5
+DEFAULT_TOP = 8
+SUBCOMMANDS = [
+    ('list regions', ['helper.help']),
+    ('list types', ['helper.help']),
+    ('list key_pairs', ['services.ec2', 'awrapperlib.clients']),
+    ('ec2', ['services.ec2', 'awrapperlib.clients']),
+    ('ec2 deploy=', ['services.ec2', 'awrapperlib.clients', 'paramiko']),
+    ('migration', ['services.ec2', 'services.rds', 'services.migration', 'awrapperlib.clients']),
+]
+
+
+def _run(modules):
+    """
+    Import main and the modules in a fresh interpreter
+    :param modules: Modules loaded by the subcommand
+    :return: Tuple (wall seconds, importtime stderr, error message or None)
+    """
+    statement = 'import main\n' + ''.join('import %s\n' % module for module in modules)
+    if 'awrapperlib.clients' in modules:
+        statement += 'awrapperlib.clients.get_session()\n'
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=PROJECT_DIR,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - start
+    if process.returncode:
+        return elapsed, process.stderr, process.stderr.strip().splitlines()[-1]
+    return elapsed, process.stderr, None
+
+
+def _slowest_imports(importtime_output, top):
+    """
+    Parse -X importtime output
+    :param importtime_output: stderr of the interpreter
+    :param top: Number of imports to return
+    :return: List of (cumulative usec, module) of the imports up to one level deep, slowest first
+    """
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main(argv):
+    runs = int(argv[1]) if len(argv) > 1 else DEFAULT_RUNS
+    top = int(argv[2]) if len(argv) > 2 else DEFAULT_TOP
+    baseline = statistics.median(_run([])[0] for _ in range(runs))
+    print('%-20s %10s' % ('subcommand', 'median ms'))
+    print('%-20s %10.1f' % ('(import main)', baseline * 1000))
+    for name, modules in SUBCOMMANDS:
+        results = [_run(modules) for _ in range(runs)]
+        error = results[-1][2]
+        if error:
+            print('%-20s %10s  %s' % (name, 'n/a', error))
+            continue
+        print('%-20s %10.1f' % (name, statistics.median(result[0] for result in results) * 1000))
+        for cumulative, module in _slowest_imports(results[-1][1], top):
+            print('    %-40s %8.1f ms' % (module, cumulative / 1000.0))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,6 +1,6 @@
 import csv
 from prettytable import PrettyTable
-from awrapperlib import resource
+from awrapperlib import ledger, resource
 
 
 def get_instance_type():
@@ -37,6 +37,16 @@ def get_regions():
         print(t)
 
 
+def get_resources():
+    """
+    Print the resources created by the wrapper, from the local ledger
+    """
+    t = PrettyTable(['Account', 'Kind', 'Region', 'Name', 'Id', 'KeyPath'])
+    for row in ledger.get_resources():
+        t.add_row([row['account'], row['kind'], row['region'], row['name'], row['resource_id'], row['key_path'] or ''])
+    print(t)
+
+
 def get_help():
     """
     Print help menu, TBD
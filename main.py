@@ -1,11 +1,5 @@
 import sys
-from services import ec2 as ec2_service
-from services import rds as rds_service
-from services import migration
-from services import vpc as vpc_service
-from services import dms as dms_service
-from helper import help
-from awrapperlib import aw, validator, logger as log, properties as props
+from awrapperlib import aw, clients, publicip, validator, logger as log, metrics, properties as props
 
 
 def main(argv):
@@ -16,14 +10,27 @@ def main(argv):
     3- Run the valid option
     :param argv: Sys argument, valid options list, ec2
     """
+    log.reset_spans()
+    metrics.reset()
     log.echo_info('Validating parameters')
     aw_props = props.get_default_props()
     values = aw_props.get_all_values()
     log.echo_info('Working with current values: %s' % values)
+    if values.get('log_queue') == 'true':
+        log.start_queue_logging(queue_size=values.get('log_queue_size', log.LOG_QUEUE_SIZE),
+                                overflow=values.get('log_queue_overflow', log.LOG_QUEUE_OVERFLOW))
+    clients.configure(**values)
+    publicip.configure(**values)
     argv.pop(0)
     # validator.validate_options(argv, **values)
     switch = Switcher(argv, **values)
-    switch.switcher()
+    try:
+        switch.switcher()
+    finally:
+        log.end_spans(values.get('trace_file'))
+        metrics.echo_report()
+        if 'api_report_file' in values:
+            metrics.write_report(values['api_report_file'])
 
 
 class Switcher:
@@ -45,54 +52,108 @@ class Switcher:
 
     def list(self):
         """
-        List options, output the available options for types, key_pairs, security_groups and regions
+        List options, output the available options for types, key_pairs, security_groups, regions and the
+        resources created by the wrapper
         """
-        ec2_helper = ec2_service.Ec2Helper(**self.kwargs)
         if self.argv[1] == 'types':
+            from helper import help
             help.get_instance_type()
         elif self.argv[1] == 'key_pairs':
-            ec2_helper.print_key_pairs()
+            from services import ec2 as ec2_service
+            ec2_service.Ec2Helper(**self.kwargs).print_key_pairs()
         elif self.argv[1] == 'security_groups':
-            ec2_helper.print_security_groups()
+            from services import ec2 as ec2_service
+            ec2_service.Ec2Helper(**self.kwargs).print_security_groups()
         elif self.argv[1] == 'regions':
+            from helper import help
             help.get_regions()
+        elif self.argv[1] == 'resources':
+            from helper import help
+            help.get_resources()
+
+    def daemon(self):
+        """
+        Daemon method, 'daemon' runs the commands received on the daemon socket until 'daemon stop'
+        """
+        from awrapperlib import daemon
+        if len(self.argv) > 1 and self.argv[1] == 'stop':
+            if daemon.send(daemon.STOP_COMMAND) is None:
+                log.echo_error('Daemon is not running')
+            return
+        daemon.serve(lambda argv: main(['main.py'] + argv))
 
     def ec2(self):
         """
         EC2 instance creation method
         """
-        log.echo_info('Creating EC2 Instance')
-        ec2_helper = ec2_service.Ec2Helper(**self.kwargs)
-        if 'security_group' not in self.kwargs:
-            security_group_id = ec2_helper.check_security_group_exists()
-            if security_group_id:
-                self.kwargs['security_group'] = security_group_id
-        ec2 = ec2_service.Ec2Creation(**self.kwargs)
-        self.kwargs.update(ec2.get_valid_properties())
-        ec2_instance = ec2.create_instance()
-        if 'deploy' in self.kwargs:
-            instance_id = ec2_instance[0].id
-            ec2_process = ec2_service.Ec2Process(instance_id, **self.kwargs)
-            if ec2_process.wait_for_instance():
-                ec2_process.copy_to_instance()
-                log.echo_info(ec2_process.get_instance_public_dns(ec2_process.instance_id))
+        from services import ec2 as ec2_service
+        with log.span('Creating EC2 Instance'):
+            ec2_helper = ec2_service.Ec2Helper(**self.kwargs)
+            if 'security_group' not in self.kwargs:
+                with log.span('Looking up default security group'):
+                    security_group_id = ec2_helper.check_security_group_exists()
+                if security_group_id:
+                    self.kwargs['security_group'] = security_group_id
+            with log.span('Preparing EC2 instance properties'):
+                ec2 = ec2_service.Ec2Creation(**self.kwargs)
+                self.kwargs.update(ec2.get_valid_properties())
+            warm_pool = ec2_service.Ec2WarmPool(ec2)
+            with log.span('Launching EC2 instance'):
+                warm_instance = warm_pool.acquire() if ec2.count == 1 else None
+                ec2_instance = [warm_instance] if warm_instance else ec2.create_instance()
+            warm_pool.refill_async()
+            if ec2.count > 1:
+                instance_ids = [instance.id for instance in ec2_instance]
+                with log.span('Wait for EC2 fleet to be ready'):
+                    ready = ec2_helper.wait_for_instances(instance_ids)
+                ec2_helper.print_fleet(instance_ids)
+                if 'deploy' in self.kwargs:
+                    ready_ids = [instance_id for instance_id, instance_ready in zip(instance_ids, ready)
+                                 if instance_ready]
+                    deployer = ec2_service.Ec2Deployer(ready_ids, **self.kwargs)
+                    deployer.print_results(deployer.deploy())
+            elif 'deploy' in self.kwargs:
+                instance_id = ec2_instance[0].id
+                ec2_process = ec2_service.Ec2Process(instance_id, **self.kwargs)
+                if warm_instance:
+                    ready = True
+                else:
+                    with log.span('Wait for EC2 instance to be ready'):
+                        ready = ec2_process.wait_for_instance()
+                if ready:
+                    with log.span('Deploying to EC2 instance'):
+                        ec2_process.copy_to_instance()
+                    instance = ec2_process.get_instance_description(instance_id)
+                    log.echo_info(instance['Reservations'][0]['Instances'][0].get('PublicDnsName'))
+
+    def bake(self):
+        """
+        Golden image method, bake an image with the user data script already run
+        """
+        from services import ec2 as ec2_service
+        with log.span('Baking golden image'):
+            image_id = ec2_service.Ec2ImageBaker(**self.kwargs).bake()
+        log.echo_info('Golden image: %s' % image_id)
 
     def migration(self):
         """
         Migration method
         """
+        from services import ec2 as ec2_service, rds as rds_service, migration
         log.echo_info('Running RDS Migration')
         if 'target' not in self.kwargs:
-            log.echo_info('Creating RDS Instance')
-            rds = rds_service.RDS(**self.kwargs)
-            rds_instance = rds.create_instance()
-            log.echo_info('RDS instance created: %s' % rds_instance[0].id)
+            with log.span('Creating RDS Instance'):
+                rds = rds_service.RDS(**self.kwargs)
+                rds_instance = rds.create_instance()['DBInstance']['DBInstanceIdentifier']
+                log.echo_info('RDS instance created: %s' % rds_instance)
             ec2_helper = ec2_service.Ec2Helper(**self.kwargs)
-            log.echo_info('Add inbound rule to security group')
-            ec2_helper.add_inbound_rule(rds.security_group, 3306)
+            with log.span('Add inbound rule to security group'):
+                ec2_helper.add_inbound_rule(rds.security_group, 3306)
             rds_helper = rds_service.RDSHelper(**self.kwargs)
-            if rds_helper.wait_for_instance(rds_instance):
-                endpoint = rds_helper.get_db_endpoint('mariadb-migration')
+            with log.span('Wait for RDS instance to be ready'):
+                ready = rds_helper.wait_for_instance(rds_instance)
+            if ready:
+                endpoint = rds_helper.get_db_endpoint(rds_instance)
                 self.kwargs['target'] = endpoint
         else:
             try:
@@ -100,10 +161,10 @@ class Switcher:
                     'Migrating from Source: %s to Target: %s' % (self.kwargs['source'], self.kwargs['target']))
             except KeyError as key:
                 aw.exit_with_error('Missing property: %s' % key)
-        log.echo_info('Starting Schema Convertion')
-        data = migration.Migration(**self.kwargs)
-        data.run_migration()
-        data.parse_execution_summary()
+        with log.span('Starting Schema Convertion'):
+            data = migration.Migration(**self.kwargs)
+            data.run_migration()
+            data.parse_execution_summary()
         log.echo_info('Finish Schema Convertion')
         log.echo_info('See log for more information')
         data.run_dms_process()
@@ -114,11 +175,20 @@ if __name__ == '__main__':
     import logging
     logging.basicConfig(level=log.LOG_DEFAULT_LEVEL, format=log.LOG_DEFAULT_FORMAT, datefmt=log.LOG_DEFAULT_DATE_FORMAT)
     log.echo_info("=== AWS WRAPPER ===")
-    if len(sys.argv) - 1 == 0:
-        help.get_help()
-        exit(1)
-    elif len(sys.argv) == 1:
-        main(sys.argv[1])
-    else:
-        main(sys.argv[0:])
+    if len(sys.argv) > 1 and sys.argv[1] != 'daemon':
+        from awrapperlib import daemon
+        daemon_exit_code = daemon.send(sys.argv[1:])
+        if daemon_exit_code is not None:
+            exit(daemon_exit_code)
+    try:
+        if len(sys.argv) - 1 == 0:
+            from helper import help
+            help.get_help()
+            exit(1)
+        elif len(sys.argv) == 1:
+            main(sys.argv[1])
+        else:
+            main(sys.argv[0:])
+    finally:
+        log.stop_queue_logging()
     exit(0)
@@ -1,5 +1,4 @@
-import boto3
-from awrapperlib import aw, logger as log, resource
+from awrapperlib import aw, clients, logger as log, resource, waiter
 
 
 class DMSFactory:
@@ -14,6 +13,7 @@ class DMSFactory:
     DEFAULT_MARIADB_CON_ARGS = 'targetDbType=SPECIFIC_DATABASE;initstmt=SET FOREIGN_KEY_CHECKS=0;parallelLoadThreads=1'
     DEFAULT_ORACLE_CON_ARGS = 'addSupplementalLogging=Y;useLogminerReader=N'
     DEFAULT_REPLICATION_TASK = 'replication-task-aws-wrapper'
+    DEFAULT_TIMEOUT = 1800
 
     def __init__(self, **kwargs):
         self.kwargs = kwargs
@@ -28,7 +28,7 @@ class DMSFactory:
         self.subnet_group_name = self.get_subnet_group_name()
         self.subnet = self.get_subnet()
         self.migration_type = self.get_migration_type()
-        self.dms_client = boto3.client('dms', region_name=self.region)
+        self.dms_client = clients.get_client('dms', self.region)
 
     def get_region(self):
         return self.kwargs['region'] if 'region' in self.kwargs else aw.DEFAULT_REGION
@@ -92,8 +92,8 @@ class DMSCreation(DMSFactory):
     def __get_dms_arn(self):
         return getattr(self, 'dms_instance')['ReplicationInstance']['ReplicationInstanceArn']
 
+    @log.timed('Creating Replication Subnet Groups')
     def __create_subnet_group(self):
-        log.echo_info('Creating Replication Subnet Groups')
         response = self.dms_client.create_replication_subnet_group(
             ReplicationSubnetGroupIdentifier=self.subnet_group_name, ReplicationSubnetGroupDescription='default',
             SubnetIds=self.subnet)
@@ -152,8 +152,8 @@ class DMSCreation(DMSFactory):
             return getattr(self, 'replication_task_arn')
 
     def wait_replication_instance(self):
-        waiter = self.dms_client.get_waiter('replication_instance_available')
-        waiter.wait(Filters=[{'Name': 'replication-instance-arn', 'Values': [self.__get_dms_arn()]}])
+        self.__wait(waiter.DMS_REPLICATION_INSTANCE, self.__get_dms_arn(), ['available'],
+                    ['incompatible-credentials', 'incompatible-network', 'inaccessible-encryption-credentials'])
 
     def start_replication_task(self):
         response = self.dms_client.start_replication_task(ReplicationTaskArn=self.__get_replication_task_arn(),
@@ -167,13 +167,25 @@ class DMSCreation(DMSFactory):
             return getattr(self, 'replication_instance_arn')
 
     def wait_replication_task_starts(self):
-        waiter = self.dms_client.get_waiter('replication_task_running')
-        waiter.wait(Filters=[{'Name': 'replication-task-arn', 'Values': [self.__get_replication_task_arn()]}])
+        self.__wait(waiter.DMS_REPLICATION_TASK, self.__get_replication_task_arn(), ['running'], ['failed', 'stopped'])
 
     def wait_replication_task_ready(self):
-        waiter = self.dms_client.get_waiter('replication_task_ready')
-        waiter.wait(Filters=[{'Name': 'replication-task-arn', 'Values': [self.__get_replication_task_arn()]}])
+        self.__wait(waiter.DMS_REPLICATION_TASK, self.__get_replication_task_arn(), ['ready'], ['failed'])
 
     def wait_test_connection(self):
-        waiter = self.dms_client.get_waiter('test_connection_succeeds')
-        waiter.wait(Filters=[{'Name': 'replication-instance-arn', 'Values': [self.__get_dms_arn()]}])
+        self.__wait(waiter.DMS_CONNECTION, self.__get_dms_arn(), ['successful'], ['failed'])
+
+    def wait_replication_task_ready_and_connection(self):
+        engine = waiter.get_engine()
+        waits = [(waiter.DMS_REPLICATION_TASK, self.__get_replication_task_arn(), ['ready'], ['failed']),
+                 (waiter.DMS_CONNECTION, self.__get_dms_arn(), ['successful'], ['failed'])]
+        futures = [engine.register(kind, arn, self.region, ready_states, failure_states, timeout=self.DEFAULT_TIMEOUT)
+                   for kind, arn, ready_states, failure_states in waits]
+        for (kind, arn, ready_states, _), future in zip(waits, futures):
+            if not future.result():
+                aw.exit_with_error('%s %s is not %s' % (kind, arn, ready_states[0]))
+
+    def __wait(self, kind, arn, ready_states, failure_states):
+        if not waiter.get_engine().wait(kind, arn, self.region, ready_states, failure_states,
+                                        timeout=self.DEFAULT_TIMEOUT):
+            aw.exit_with_error('%s %s is not %s' % (kind, arn, ready_states[0]))
@@ -2,20 +2,41 @@
 EC2 handler
 """
 
-import boto3
+import atexit
+import copy
+import hashlib
 import os
+import queue
+import threading
 import time
 from prettytable import PrettyTable
-from awrapperlib import aw, resource, logger as log
+from awrapperlib import aw, cache, clients, ledger, metrics, resource, transfer, waiter, logger as log
 from multipledispatch import dispatch
 from botocore.exceptions import ClientError
-import paramiko as ssh
-from paramiko.ssh_exception import NoValidConnectionsError
-from urllib3.exceptions import NewConnectionError
+import random
 import socket
 
 DEFAULT_SECURITY_GROUP_NAME = 'AWS-Wrapper'
+SHUTDOWN_SCRIPT = '\nshutdown -h now\n'
 DEFAULT_REGION = aw.DEFAULT_REGION
+_SSH_SESSIONS = {}
+_INSTANCE_CACHE = {}
+_INSTANCE_CACHE_LOCK = threading.Lock()
+_IMAGE_CACHE = cache.DiskCache('images')
+_SECURITY_GROUP_INDEXES = {}
+_SECURITY_GROUP_INDEXES_LOCK = threading.Lock()
+
+
+def close_ssh_sessions():
+    """
+    Close the SSH connections kept open by Ec2Process
+    """
+    while _SSH_SESSIONS:
+        _, ssh_client = _SSH_SESSIONS.popitem()
+        ssh_client.close()
+
+
+atexit.register(close_ssh_sessions)
 
 
 class EC2Factory:
@@ -25,6 +46,7 @@ class EC2Factory:
     DEFAULT_IMAGE_ID = 'ami-0cd3dfa4e37921605'  # Amazon Linux
     DEFAULT_KEY_PAIR_SUFFIX = 'ec2-keypair'
     DEFAULT_TYPE = 't2.micro'
+    DEFAULT_COUNT = 1
     TOMCAT_IP_PERMISSIONS = {'FromPort': 8080, 'IpProtocol': 'tcp',
                              'IpRanges': [{'CidrIp': '0.0.0.0/0', 'Description': 'TomcatConnection'}], 'ToPort': 8080}
     DEFAULT_IP_PERMISSIONS = {'FromPort': 22, 'IpProtocol': 'tcp',
@@ -34,55 +56,95 @@ class EC2Factory:
         self.kwargs = kwargs
         self.name = self.get_name()
         self.region = self.get_region()
-        self.ec2 = boto3.resource('ec2', region_name=self.region)
+        self.ec2 = clients.get_resource('ec2', self.region)
         self.type = self.get_type()
+        self.count = self.get_count()
+        self.min_count = self.get_min_count()
         self.user_data = self.get_user_data()
         self.key_pair_name = self.get_key_pair_name()
+        self.golden_image = self.get_golden_image()
         self.image = self.get_image()
         self.security_group = self.get_security_group()
 
     def __create_key_pair(self):
-        log.echo_info('Creating Key Pair')
-        key_pair_file_name = self.name + self.DEFAULT_KEY_PAIR_SUFFIX + '.pem'
         key_pair_name = self.name + self.DEFAULT_KEY_PAIR_SUFFIX
-        output_file = open(key_pair_file_name, 'w')
+        recorded = ledger.get(ledger.KEY_PAIR, self.region, key_pair_name)
+        reusable = recorded is not None and os.path.exists(recorded['key_path'])
+        if reusable and not Ec2Helper(region=self.region).key_pair_exists(key_pair_name):
+            log.echo_warning('Key Pair %s no longer exists, creating it again' % key_pair_name)
+            ledger.remove(ledger.KEY_PAIR, self.region, key_pair_name)
+            os.remove(recorded['key_path'])
+            reusable = False
+        metrics.record_cache('ec2.create_key_pair', reusable)
+        if reusable:
+            log.echo_info('Reusing Key Pair %s (%s)' % (key_pair_name, recorded['key_path']))
+            return self.__use_key_pair(key_pair_name, recorded['key_path'])
+        log.echo_info('Creating Key Pair')
+        key_pair_file_name = os.path.abspath(key_pair_name + '.pem')
         key_pair = self.ec2.create_key_pair(KeyName=key_pair_name)
-        key_pair_out = str(key_pair.key_material)
-        output_file.write(key_pair_out)
+        with open(key_pair_file_name, 'w') as output_file:
+            output_file.write(str(key_pair.key_material))
         os.chmod(key_pair_file_name, 0o400)
+        ledger.record(ledger.KEY_PAIR, self.region, key_pair_name, key_pair_name, key_path=key_pair_file_name)
+        return self.__use_key_pair(key_pair_name, key_pair_file_name)
+
+    def __use_key_pair(self, key_pair_name, key_pair_file_name):
+        self.key_pair = key_pair_name
+        self.key_path = os.path.dirname(key_pair_file_name)
         return key_pair_name
 
     def __create_security_group(self):
+        recorded = ledger.get(ledger.SECURITY_GROUP, self.region, DEFAULT_SECURITY_GROUP_NAME)
+        if recorded is not None:
+            try:
+                self.__add_ssh_inbound_rule(recorded['resource_id'])
+                log.echo_info('Reusing Security Group %s' % recorded['resource_id'])
+                return recorded['resource_id']
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'InvalidGroup.NotFound':
+                    raise
+                ledger.remove(ledger.SECURITY_GROUP, self.region, DEFAULT_SECURITY_GROUP_NAME)
         log.echo_info('Creating Security Group')
-        create_security_group = self.ec2.create_security_group(Description=DEFAULT_SECURITY_GROUP_NAME + ' SG',
-                                                               GroupName=DEFAULT_SECURITY_GROUP_NAME)
-        security_group_id = create_security_group.id
-        security_group = self.ec2.SecurityGroup(security_group_id)
-        security_group.create_tags(Tags=[{'Key': 'Name', 'Value': DEFAULT_SECURITY_GROUP_NAME}])
-        security_group.authorize_ingress(GroupId=security_group_id, IpPermissions=[self.__get_ip_permissions()])
+        tags = [{'Key': 'Name', 'Value': DEFAULT_SECURITY_GROUP_NAME}]
+        security_group = self.ec2.create_security_group(Description=DEFAULT_SECURITY_GROUP_NAME + ' SG',
+                                                        GroupName=DEFAULT_SECURITY_GROUP_NAME,
+                                                        TagSpecifications=[{'ResourceType': 'security-group',
+                                                                            'Tags': tags}])
+        security_group_id = security_group.id
+        ledger.record(ledger.SECURITY_GROUP, self.region, DEFAULT_SECURITY_GROUP_NAME, security_group_id,
+                      tags={'Name': DEFAULT_SECURITY_GROUP_NAME})
+        Ec2Helper(region=self.region).index_security_group(
+            dict(GroupId=security_group_id, GroupName=DEFAULT_SECURITY_GROUP_NAME,
+                 Description=DEFAULT_SECURITY_GROUP_NAME + ' SG',
+                 Tags=tags))
+        security_group.authorize_ingress(GroupId=security_group_id, IpPermissions=self.__get_ip_permissions())
         return security_group_id
 
     def __get_ip_permissions(self):
         permissions = []
         if self.user_data == 'tomcat':
-            permissions.append(self.TOMCAT_IP_PERMISSIONS)
+            permissions.append(copy.deepcopy(self.TOMCAT_IP_PERMISSIONS))
         permissions.append(self.__get_ssh_permissions())
         return permissions
 
     def __add_ssh_inbound_rule(self, security_group_id):
-        try:
-            security_group = self.ec2.SecurityGroup(security_group_id)
-            security_group.authorize_ingress(GroupId=security_group_id, IpPermissions=[self.__get_ssh_permissions()])
-        except ClientError:
-            pass
+        Ec2Helper(region=self.region).reconcile_inbound_rules(security_group_id, [self.__get_ssh_permissions()])
 
     def __get_ssh_permissions(self):
-        ip_permissions = self.DEFAULT_IP_PERMISSIONS
+        ip_permissions = copy.deepcopy(self.DEFAULT_IP_PERMISSIONS)
         ip_permissions['IpRanges'][0]['CidrIp'] = aw.get_public_ip()
         return ip_permissions
 
     def __set_security_group(self):
-        self.__add_ssh_inbound_rule(self.kwargs['security_group'])
+        try:
+            self.__add_ssh_inbound_rule(self.kwargs['security_group'])
+        except ClientError as e:
+            recorded = ledger.get(ledger.SECURITY_GROUP, self.region, DEFAULT_SECURITY_GROUP_NAME)
+            if e.response['Error']['Code'] != 'InvalidGroup.NotFound' or recorded is None or \
+                    recorded['resource_id'] != self.kwargs['security_group']:
+                raise
+            ledger.remove(ledger.SECURITY_GROUP, self.region, DEFAULT_SECURITY_GROUP_NAME)
+            return self.__create_security_group()
         return self.kwargs['security_group']
 
     def get_name(self):
@@ -106,6 +168,20 @@ class EC2Factory:
         """
         return self.kwargs['type'] if 'type' in self.kwargs else self.DEFAULT_TYPE
 
+    def get_count(self):
+        """
+        Get number of instances to launch
+        :return: Instance count
+        """
+        return int(self.kwargs['count']) if 'count' in self.kwargs else self.DEFAULT_COUNT
+
+    def get_min_count(self):
+        """
+        Get minimum number of instances to launch, the launch fails if fewer are available
+        :return: Minimum instance count, default is count
+        """
+        return int(self.kwargs['min_count']) if 'min_count' in self.kwargs else self.count
+
     def get_user_data(self):
         """
         Get user data to deploy on instance
@@ -122,11 +198,66 @@ class EC2Factory:
 
     def get_image(self):
         """
-        Get image Id to use in instance
+        Get image Id to use in instance, the golden image of the user data script when one was baked
+        :return: Image id
+        """
+        return self.golden_image if self.golden_image else self.get_base_image()
+
+    def get_base_image(self):
+        """
+        Get image Id the user data script runs on
         :return: Image id
         """
         return self.kwargs['image'] if 'image' in self.kwargs else self.DEFAULT_IMAGE_ID
 
+    def get_golden_image(self):
+        """
+        Get the golden image baked from the current user data script on the base image, see Ec2ImageBaker.
+        Images that are no longer available are forgotten
+        :return: Image id, None when no image was baked for this script, region and base image
+        """
+        if not self.user_data:
+            return None
+        recorded = ledger.get(ledger.GOLDEN_IMAGE, self.region, self.get_golden_image_key())
+        image_id = recorded['resource_id'] if recorded else None
+        if image_id:
+            images = self.ec2.meta.client.describe_images(Filters=[dict(Name='image-id', Values=[image_id])])
+            if not any(image['State'] == 'available' for image in images['Images']):
+                log.echo_warning('Golden image %s is no longer available' % image_id)
+                ledger.remove(ledger.GOLDEN_IMAGE, self.region, self.get_golden_image_key())
+                image_id = None
+        metrics.record_cache('ec2.golden_image', image_id is not None)
+        if image_id:
+            log.echo_info('Using golden image %s for user data %s' % (image_id, self.user_data))
+        return image_id
+
+    def get_golden_image_key(self):
+        """
+        Get the golden image key: base image and SHA-256 of the user data script
+        :return: Golden image key
+        """
+        return '%s:%s' % (self.get_base_image(), self.get_user_data_digest())
+
+    def get_user_data_digest(self):
+        """
+        Get the SHA-256 of the user data script
+        :return: Hex digest, empty when no user data is set
+        """
+        if not self.user_data:
+            return ''
+        return hashlib.sha256(self.get_user_data_script().encode('utf-8')).hexdigest()
+
+    def get_user_data_script(self):
+        """
+        Get the content of the user data script
+        :return: Script content
+        """
+        if self.user_data == 'tomcat':
+            script_file = resource.get_resource('Tomcat/tomcat.sh')
+            return aw.file_to_string(script_file)
+        else:
+            aw.exit_with_error('Init Script not supported')
+
     def get_security_group(self):
         """
         Get security group to use on instance
@@ -156,32 +287,314 @@ class Ec2Creation(EC2Factory):
 
     def create_instance(self):
         """
-        Create instance method
-        :return: Instance Id
+        Create instance method, launches between min_count and count instances in a single call
+        :return: Instance list
         """
-        tag = [{'ResourceType': 'instance', 'Tags': [{'Key': 'Name', 'Value': self.name}]},
-               {'ResourceType': 'volume', 'Tags': [{'Key': 'Name', 'Value': self.name}]}]
-        instance_options = dict(ImageId=self.image, MinCount=1, MaxCount=1, InstanceType=self.type,
-                                KeyName=self.key_pair_name, TagSpecifications=tag)
-        instance_options.update(self.__add_extra_options())
+        tags = [{'Key': 'Name', 'Value': self.name}]
+        if self.count > 1:
+            tags.append({'Key': 'Fleet', 'Value': self.name})
+        tag = [{'ResourceType': 'instance', 'Tags': tags},
+               {'ResourceType': 'volume', 'Tags': tags}]
+        instance_options = self.get_launch_options()
+        instance_options.update(dict(MinCount=self.min_count, MaxCount=self.count, TagSpecifications=tag))
         instance = self.ec2.create_instances(**instance_options)
+        for launched in instance:
+            ledger.record(ledger.INSTANCE, self.region, launched.id, launched.id, tags={'Name': self.name})
+        if self.count > 1:
+            self.__tag_fleet(instance)
         return instance
 
+    def __tag_fleet(self, instances):
+        log.echo_info('Launched %d instances for fleet %s' % (len(instances), self.name))
+        for index, instance in enumerate(instances):
+            instance.create_tags(Tags=[{'Key': 'Name', 'Value': '%s-%d' % (self.name, index)},
+                                       {'Key': 'FleetIndex', 'Value': str(index)}])
+
+    def get_launch_options(self):
+        """
+        Get the create_instances options shared by every launch: image, type, key pair, user data and
+        security group
+        :return: Dictionary of create_instances options
+        """
+        launch_options = dict(ImageId=self.image, InstanceType=self.type, KeyName=self.key_pair_name)
+        launch_options.update(self.__add_extra_options())
+        return launch_options
+
     def __add_extra_options(self):
         extra_options = dict()
-        if self.user_data:
-            self.user_data = self.__read_script_file()
-            extra_options.update(dict(UserData=self.user_data))
+        if self.user_data and not self.golden_image:
+            extra_options.update(dict(UserData=self.get_user_data_script()))
         if self.security_group:
             extra_options.update(dict(SecurityGroupIds=[self.security_group]))
         return extra_options
 
-    def __read_script_file(self):
-        if self.user_data == 'tomcat':
-            script_file = resource.get_resource('Tomcat/tomcat.sh')
-            return aw.file_to_string(script_file)
-        else:
-            aw.exit_with_error('Init Script not supported')
+
+class Ec2WarmPool:
+    """
+    Pool of stopped, already bootstrapped instances per launch configuration. Pool instances run the user
+    data script once and power themselves off, a launch starts one of them instead of booting a new one
+    """
+    DEFAULT_POOL_SIZE = 0
+    POOL_TAG = 'AWS-Wrapper-WarmPool'
+    POOLED_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+    def __init__(self, ec2_creation):
+        """
+        :param ec2_creation: Ec2Creation holding the launch configuration of the pool
+        """
+        self.ec2_creation = ec2_creation
+        self.kwargs = ec2_creation.kwargs
+        self.ec2 = ec2_creation.ec2
+        self.size = self.get_pool_size()
+        self.pool_key = self.get_pool_key()
+
+    def get_pool_size(self):
+        """
+        Get the number of warm instances to keep per launch configuration
+        :return: Pool size, 0 disables the pool
+        """
+        return int(self.kwargs['warm_pool_size']) if 'warm_pool_size' in self.kwargs else self.DEFAULT_POOL_SIZE
+
+    def get_pool_key(self):
+        """
+        Get the pool tag value, instances are only shared between launches with the same type, image,
+        user data script content and key pair
+        :return: Pool key
+        """
+        return ':'.join([self.ec2_creation.type, self.ec2_creation.image, self.ec2_creation.get_user_data_digest(),
+                         self.ec2_creation.key_pair_name])
+
+    def acquire(self):
+        """
+        Start a warm instance and take it out of the pool
+        :return: Instance, None if the pool is disabled or empty
+        """
+        if self.size <= 0:
+            return None
+        for instance in self.__get_pool_instances(['stopped']):
+            try:
+                response = instance.start()
+            except ClientError as e:
+                log.echo_debug('Warm instance %s could not be started: %s', instance.id, e)
+                continue
+            if response['StartingInstances'][0]['PreviousState']['Name'] != 'stopped':
+                log.echo_debug('Warm instance %s taken by another run', instance.id)
+                continue
+            instance.delete_tags(Tags=[{'Key': self.POOL_TAG}])
+            instance.create_tags(Tags=[{'Key': 'Name', 'Value': self.ec2_creation.name}])
+            if self.ec2_creation.security_group and \
+                    self.ec2_creation.security_group not in [group['GroupId'] for group in instance.security_groups]:
+                instance.modify_attribute(Groups=[self.ec2_creation.security_group])
+            log.echo_info('Starting warm instance %s' % instance.id)
+            return instance
+        log.echo_info('Warm pool is empty, launching a new instance')
+        return None
+
+    def refill(self, ec2=None):
+        """
+        Launch the instances missing from the pool, they bootstrap and stop on their own
+        :param ec2: EC2 resource to use, default is the resource of the launch configuration
+        :return: List with the launched instances
+        """
+        if self.size <= 0:
+            return []
+        ec2 = ec2 or self.ec2
+        missing = self.size - len(list(self.__get_pool_instances(self.POOLED_STATES, ec2)))
+        if missing <= 0:
+            return []
+        log.echo_info('Launching %d instances to refill the warm pool' % missing)
+        tags = [{'Key': 'Name', 'Value': self.POOL_TAG}, {'Key': self.POOL_TAG, 'Value': self.pool_key}]
+        launch_options = self.ec2_creation.get_launch_options()
+        launch_options.update(dict(MinCount=1, MaxCount=missing, InstanceInitiatedShutdownBehavior='stop',
+                                   UserData=launch_options.get('UserData', '#!/bin/bash\n') + SHUTDOWN_SCRIPT,
+                                   TagSpecifications=[{'ResourceType': 'instance', 'Tags': tags},
+                                                      {'ResourceType': 'volume', 'Tags': tags}]))
+        instances = ec2.create_instances(**launch_options)
+        for instance in instances:
+            ledger.record(ledger.INSTANCE, self.ec2_creation.region, instance.id, instance.id,
+                          tags={'Name': self.POOL_TAG, self.POOL_TAG: self.pool_key})
+        return instances
+
+    def refill_async(self):
+        """
+        Refill the pool in a background thread with its own EC2 resource. The thread is not a daemon thread,
+        the command returns without waiting and the process, or the daemon, exits once the refill is done
+        :return: Started thread
+        """
+        if self.size <= 0:
+            return None
+        thread = threading.Thread(target=self.__refill_in_thread, name='warm-pool-refill')
+        thread.start()
+        return thread
+
+    def __refill_in_thread(self):
+        try:
+            self.refill(clients.new_resource('ec2', self.ec2_creation.region))
+        except Exception as e:
+            log.echo_warning('Warm pool refill failed: %r' % e)
+
+    def __get_pool_instances(self, states, ec2=None):
+        return (ec2 or self.ec2).instances.filter(Filters=[dict(Name='tag:' + self.POOL_TAG, Values=[self.pool_key]),
+                                                  dict(Name='instance-state-name', Values=states)])
+
+
+class Ec2ImageDefinition(EC2Factory):
+    """
+    Image part of the EC2 options: region, type, base image and user data. Unlike Ec2Creation, no key pair or
+    security group is created
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.region = self.get_region()
+        self.ec2 = clients.get_resource('ec2', self.region)
+        self.type = self.get_type()
+        self.user_data = self.get_user_data()
+        self.golden_image = self.get_golden_image()
+        self.image = self.get_image()
+
+
+class Ec2ImageBaker:
+    """
+    Bake a golden image from the user data script: the script runs once on a builder instance that powers
+    itself off, the image is created from the stopped instance and recorded by script content hash, so
+    later launches of the same script start from the image and skip the bootstrap
+    """
+    DEFAULT_TIMEOUT = 1800
+    BUILDER_NAME = 'AWS-Wrapper-Bake'
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: Dictionary containing the properties file options (region, type, image, user_data)
+        """
+        self.ec2_image = Ec2ImageDefinition(**kwargs)
+        self.region = self.ec2_image.region
+        self.ec2 = self.ec2_image.ec2
+
+    def bake(self):
+        """
+        Bake the golden image of the current user data script, unless it is already available
+        :return: Image Id
+        """
+        if not self.ec2_image.user_data:
+            aw.exit_with_error('user_data must be specified to bake an image')
+        if self.ec2_image.golden_image:
+            log.echo_info('Golden image %s is up to date' % self.ec2_image.golden_image)
+            return self.ec2_image.golden_image
+        script = self.ec2_image.get_user_data_script()
+        tags = [{'Key': 'Name', 'Value': self.BUILDER_NAME}]
+        instance = self.ec2.create_instances(
+            ImageId=self.ec2_image.get_base_image(), InstanceType=self.ec2_image.type, MinCount=1, MaxCount=1,
+            UserData=script + SHUTDOWN_SCRIPT, InstanceInitiatedShutdownBehavior='stop',
+            TagSpecifications=[{'ResourceType': 'instance', 'Tags': tags}])[0]
+        try:
+            with log.span('Bootstrapping builder instance %s' % instance.id):
+                self.__wait(waiter.EC2_INSTANCE_STATE, instance.id, ['stopped'], ['terminated'])
+            digest = self.ec2_image.get_user_data_digest()
+            name = 'aws-wrapper-%s-%s-%d' % (self.ec2_image.user_data, digest[:12], int(time.time()))
+            image = instance.create_image(Name=name, TagSpecifications=[{'ResourceType': 'image', 'Tags': [
+                {'Key': 'Name', 'Value': name}, {'Key': 'UserDataSha256', 'Value': digest}]}])
+            with log.span('Creating image %s' % image.id):
+                self.__wait(waiter.EC2_IMAGE, image.id, ['available'], ['failed', 'error', 'invalid', 'deregistered'])
+        finally:
+            instance.terminate()
+        ledger.record(ledger.GOLDEN_IMAGE, self.region, self.ec2_image.get_golden_image_key(), image.id,
+                      tags={'Name': name, 'UserDataSha256': digest})
+        log.echo_info('Golden image %s baked for user data %s' % (image.id, self.ec2_image.user_data))
+        return image.id
+
+    def __wait(self, kind, resource_id, ready_states, failure_states):
+        if not waiter.get_engine().wait(kind, resource_id, self.region, ready_states, failure_states,
+                                        timeout=self.DEFAULT_TIMEOUT):
+            aw.exit_with_error('Timeout or failure waiting for %s' % resource_id)
+
+
+class SecurityGroupIndex:
+    """
+    Name, Id and tag index over the security groups of a region, filled on demand with filtered describe
+    calls. Names, Ids and tags that were looked up are remembered, so a missing group isn't queried again either
+    """
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_name = {}
+        self.by_tag = {}
+        self.checked_ids = set()
+        self.checked_names = set()
+        self.checked_tags = set()
+
+    def add(self, security_group):
+        """
+        Add or replace a security group
+        :param security_group: Security group description, as returned by describe_security_groups
+        """
+        self.remove(security_group['GroupId'])
+        self.by_id[security_group['GroupId']] = security_group
+        self.by_name.setdefault(security_group['GroupName'], []).append(security_group['GroupId'])
+        for tag in security_group.get('Tags', []):
+            self.by_tag.setdefault((tag['Key'], tag['Value']), []).append(security_group['GroupId'])
+        self.checked_ids.add(security_group['GroupId'])
+
+    def remove(self, security_group_id):
+        """
+        Remove a security group
+        :param security_group_id: Security group Id
+        """
+        security_group = self.by_id.pop(security_group_id, None)
+        if security_group is None:
+            return
+        self.by_name[security_group['GroupName']].remove(security_group_id)
+        for tag in security_group.get('Tags', []):
+            self.by_tag[(tag['Key'], tag['Value'])].remove(security_group_id)
+
+    def get_unchecked(self, group_names=(), group_ids=(), tags=()):
+        """
+        Get the names, Ids and tags that were never looked up
+        :param group_names: Security group names
+        :param group_ids: Security group Ids
+        :param tags: Tuples (key, value)
+        :return: Tuple (list of names, list of Ids, list of tags)
+        """
+        return ([name for name in group_names if name not in self.checked_names],
+                [group_id for group_id in group_ids if group_id not in self.checked_ids],
+                [tag for tag in tags if tag not in self.checked_tags])
+
+    def mark_checked(self, group_names=(), group_ids=(), tags=()):
+        """
+        Record that names, Ids and tags were looked up, whether they exist or not
+        :param group_names: Security group names
+        :param group_ids: Security group Ids
+        :param tags: Tuples (key, value)
+        """
+        self.checked_names.update(group_names)
+        self.checked_ids.update(group_ids)
+        self.checked_tags.update(tags)
+
+    def get(self, security_group_id):
+        """
+        Get a security group by Id
+        :param security_group_id: Security group Id
+        :return: Security group description, None if it doesn't exist
+        """
+        return self.by_id.get(security_group_id)
+
+    def get_id_by_name(self, security_group_name):
+        """
+        Get a security group Id by name
+        :param security_group_name: Security group name
+        :return: Id of the first group with that name, None if it doesn't exist
+        """
+        security_group_ids = self.by_name.get(security_group_name)
+        return security_group_ids[0] if security_group_ids else None
+
+    def get_ids_by_tag(self, key, value):
+        """
+        Get the Ids of the security groups with a tag
+        :param key: Tag key
+        :param value: Tag value
+        :return: List of security group Ids
+        """
+        return list(self.by_tag.get((key, value), []))
 
 
 class Ec2Helper:
@@ -189,14 +602,16 @@ class Ec2Helper:
     Ec2 help method, get instance information
     """
     DEFAULT_STATUS = 'does-not-exist'
+    DEFAULT_WAIT_TIMEOUT = 600
+    DEFAULT_DESCRIPTION_TTL = 5
+    DEFAULT_INDEX_TTL = 300
     DEFAULT_IP_PERMISSIONS = {'FromPort': 0, 'IpProtocol': 'tcp',
                               'IpRanges': [{'CidrIp': '0.0.0.0/0', 'Description': ''}], 'ToPort': 0}
 
     def __init__(self, **kwargs):
         self.kwargs = kwargs
         self.region = self.get_region()
-        self.ec2 = boto3.client('ec2', region_name=self.region)
-        self.response = []
+        self.ec2 = clients.get_client('ec2', self.region)
 
     def get_region(self):
         """
@@ -210,8 +625,7 @@ class Ec2Helper:
         Print available key pairs from AWS
         """
         t = PrettyTable(['KeyName'])
-        response = self.get_key_pairs()
-        for data in response:
+        for data in self.iter_key_pairs():
             t.add_row([data])
         log.echo_info(t)
 
@@ -219,22 +633,129 @@ class Ec2Helper:
         """
         Print available security groups from AWS
         """
-        response = self.get_security_groups()
         t = PrettyTable(['GroupName', 'Description'])
-        for data in response:
-            t.add_row([data[0], data[1]])
+        for data in self.iter_security_groups():
+            t.add_row([data['GroupId'], data['Description']])
         log.echo_info(t)
 
+    def iter_key_pairs(self, key_names=None):
+        """
+        Iterate over the key pairs on AWS
+        :param key_names: Only yield these key names, filtered server side
+        :return: Generator of key names
+        """
+        filters = [dict(Name='key-name', Values=list(key_names))] if key_names is not None else []
+        for data in self.__paginate('describe_key_pairs', 'KeyPairs', Filters=filters):
+            yield data['KeyName']
+
+    def iter_security_groups(self, group_names=None, group_ids=None, filters=None):
+        """
+        Iterate page by page over the security groups on AWS
+        :param group_names: Only yield these group names, filtered server side
+        :param group_ids: Only yield these group ids, filtered server side
+        :param filters: Extra describe_security_groups filters
+        :return: Generator of security group descriptions
+        """
+        filters = list(filters or [])
+        if group_names is not None:
+            filters.append(dict(Name='group-name', Values=list(group_names)))
+        if group_ids is not None:
+            filters.append(dict(Name='group-id', Values=list(group_ids)))
+        return self.__paginate('describe_security_groups', 'SecurityGroups', Filters=filters)
+
+    def __paginate(self, operation, result_key, **kwargs):
+        if self.ec2.can_paginate(operation):
+            pages = self.ec2.get_paginator(operation).paginate(**kwargs)
+        else:
+            pages = [getattr(self.ec2, operation)(**kwargs)]
+        for page in pages:
+            for data in page[result_key]:
+                yield data
+
+    def key_pair_exists(self, key_name):
+        """
+        Check if a key pair exists, without listing every key pair
+        :param key_name: Key pair name
+        :return: True if the key pair exists, else return False
+        """
+        return any(True for _ in self.iter_key_pairs([key_name]))
+
+    def security_group_id_exists(self, security_group_id):
+        """
+        Check if a security group exists
+        :param security_group_id: Security group Id
+        :return: True if the security group exists, else return False
+        """
+        return self.lookup_security_groups(group_ids=[security_group_id]).get(security_group_id) is not None
+
+    def get_security_group_index(self):
+        """
+        Get the security group index of the region, reused for DEFAULT_INDEX_TTL seconds
+        :return: SecurityGroupIndex
+        """
+        with _SECURITY_GROUP_INDEXES_LOCK:
+            cached = _SECURITY_GROUP_INDEXES.get(self.region)
+            if cached is None or cached[0] <= time.time():
+                cached = (time.time() + self.DEFAULT_INDEX_TTL, SecurityGroupIndex())
+                _SECURITY_GROUP_INDEXES[self.region] = cached
+            return cached[1]
+
+    def lookup_security_groups(self, group_names=(), group_ids=(), tags=()):
+        """
+        Make sure security groups are in the index, names, Ids and tags never looked up are fetched with
+        filtered describe calls
+        :param group_names: Security group names
+        :param group_ids: Security group Ids
+        :param tags: Tuples (key, value)
+        :return: SecurityGroupIndex
+        """
+        index = self.get_security_group_index()
+        with _SECURITY_GROUP_INDEXES_LOCK:
+            names, ids, unchecked_tags = index.get_unchecked(group_names, group_ids, tags)
+        metrics.record_cache('ec2.describe_security_groups', not names and not ids and not unchecked_tags)
+        found = []
+        if names:
+            found.extend(self.iter_security_groups(group_names=names))
+        if ids:
+            found.extend(self.iter_security_groups(group_ids=ids))
+        values_by_key = {}
+        for key, value in unchecked_tags:
+            values_by_key.setdefault(key, []).append(value)
+        for key, values in values_by_key.items():
+            found.extend(self.iter_security_groups(filters=[dict(Name='tag:' + key, Values=values)]))
+        with _SECURITY_GROUP_INDEXES_LOCK:
+            for security_group in found:
+                index.add(security_group)
+            index.mark_checked(names, ids, unchecked_tags)
+        return index
+
+    def get_security_group_ids_by_tag(self, key, value):
+        """
+        Get the Ids of the security groups with a tag from the security group index
+        :param key: Tag key
+        :param value: Tag value
+        :return: List of security group Ids
+        """
+        index = self.lookup_security_groups(tags=[(key, value)])
+        with _SECURITY_GROUP_INDEXES_LOCK:
+            return index.get_ids_by_tag(key, value)
+
+    def index_security_group(self, security_group):
+        """
+        Add a security group created or changed by the wrapper to the index
+        :param security_group: Security group description (GroupId, GroupName, Description, Tags)
+        """
+        index = self.get_security_group_index()
+        with _SECURITY_GROUP_INDEXES_LOCK:
+            index.add(security_group)
+            index.mark_checked([security_group['GroupName']])
+
     def get_key_pairs(self):
         """
         Get available key pairs from AWS
         :return: List with key pairs [KeyName]
         """
-        new_response = []
-        response = self.ec2.describe_key_pairs()
-        for data in response['KeyPairs']:
-            new_response.append(data['KeyName'])
-        return new_response
+        return list(self.iter_key_pairs())
 
     @dispatch()
     def get_security_groups(self):
@@ -242,10 +763,7 @@ class Ec2Helper:
         Get available security groups on AWS by GroupId and Description
         :return: List with security groups [[GroupId, Description]]
         """
-        response = self.ec2.describe_security_groups()
-        for data in response['SecurityGroups']:
-            self.response.append([data['GroupId'], data['Description']])
-        return self.response
+        return [[data['GroupId'], data['Description']] for data in self.iter_security_groups()]
 
     @dispatch(str)
     def get_security_groups(self, _):
@@ -254,20 +772,14 @@ class Ec2Helper:
         :param _: Overload method to get GroupId
         :return: List with security groups [GroupId]
         """
-        response = self.ec2.describe_security_groups()
-        for data in response['SecurityGroups']:
-            self.response.append(data['GroupId'])
-        return self.response
+        return [data['GroupId'] for data in self.iter_security_groups()]
 
     def get_security_groups_by_name(self):
         """
         Get available security groups on AWS by GroupId and GroupName
         :return: List with security groups [[GroupId, GroupName]]
         """
-        response = self.ec2.describe_security_groups()
-        for data in response['SecurityGroups']:
-            self.response.append([data['GroupId'], data['GroupName']])
-        return self.response
+        return [[data['GroupId'], data['GroupName']] for data in self.iter_security_groups()]
 
     def get_instance_status(self, instance_id):
         """
@@ -276,7 +788,9 @@ class Ec2Helper:
         :return: Instance status
         """
         if self.instance_exists(instance_id):
-            status = self.ec2.describe_instance_status(InstanceIds=[instance_id], IncludeAllInstances=True)
+            status = self.__get_cached('describe_instance_status', instance_id,
+                                       lambda: self.ec2.describe_instance_status(InstanceIds=[instance_id],
+                                                                                 IncludeAllInstances=True))
             status = next(iter(status.items()))[1][0]['SystemStatus']['Status']
         else:
             status = self.DEFAULT_STATUS
@@ -308,11 +822,80 @@ class Ec2Helper:
 
     def get_instance_description(self, instance_id):
         """
-        Get instance description
+        Get instance description, cached for DEFAULT_DESCRIPTION_TTL seconds
         :param instance_id: Instance Id
         :return: Instance description
         """
-        return self.ec2.describe_instances(InstanceIds=[instance_id])
+        return self.__get_cached('describe_instances', instance_id,
+                                 lambda: self.ec2.describe_instances(InstanceIds=[instance_id]))
+
+    def invalidate_instance(self, instance_id=None):
+        """
+        Drop cached descriptions after a state-changing call
+        :param instance_id: Instance Id, None to drop every instance of the region
+        """
+        with _INSTANCE_CACHE_LOCK:
+            for key in [key for key in _INSTANCE_CACHE if key[0] == self.region and
+                        (instance_id is None or key[2] == instance_id)]:
+                del _INSTANCE_CACHE[key]
+
+    def __get_cached(self, operation, instance_id, describe):
+        key = (self.region, operation, instance_id)
+        with _INSTANCE_CACHE_LOCK:
+            cached = _INSTANCE_CACHE.get(key)
+        if cached is not None and cached[0] > time.time():
+            metrics.record_cache('ec2.' + operation, True)
+            return cached[1]
+        metrics.record_cache('ec2.' + operation, False)
+        response = describe()
+        with _INSTANCE_CACHE_LOCK:
+            _INSTANCE_CACHE[key] = (time.time() + self.DEFAULT_DESCRIPTION_TTL, response)
+        return response
+
+    def wait_for_instances(self, instance_ids, timeout=DEFAULT_WAIT_TIMEOUT):
+        """
+        Wait for many instances at once
+        :param instance_ids: Instance Id list
+        :param timeout: Seconds to wait
+        :return: List with True for each instance that is ready, else False
+        """
+        log.echo_info('Wait %s seconds for %d EC2 instances to be ready' % (timeout, len(instance_ids)))
+        engine = waiter.get_engine()
+        futures = [engine.register(waiter.EC2_INSTANCE, instance_id, self.region, ['ok'], timeout=timeout)
+                   for instance_id in instance_ids]
+        ready = [future.result() for future in futures]
+        for instance_id in instance_ids:
+            self.invalidate_instance(instance_id)
+        return ready
+
+    def get_fleet_description(self, instance_ids):
+        """
+        Get Id, IP and DNS of many instances with a single describe call
+        :param instance_ids: Instance Id list
+        :return: List of dictionaries (index, instance_id, state, public_ip, public_dns, private_ip) sorted by index
+        """
+        fleet = []
+        paginator = self.ec2.get_paginator('describe_instances')
+        for page in paginator.paginate(InstanceIds=instance_ids):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+                    fleet.append(dict(index=int(tags.get('FleetIndex', 0)), instance_id=instance['InstanceId'],
+                                      state=instance['State']['Name'], public_ip=instance.get('PublicIpAddress'),
+                                      public_dns=instance.get('PublicDnsName'),
+                                      private_ip=instance.get('PrivateIpAddress')))
+        return sorted(fleet, key=lambda description: description['index'])
+
+    def print_fleet(self, instance_ids):
+        """
+        Print Id, IP and DNS of many instances
+        :param instance_ids: Instance Id list
+        """
+        t = PrettyTable(['Index', 'InstanceId', 'State', 'PublicIp', 'PublicDns'])
+        for description in self.get_fleet_description(instance_ids):
+            t.add_row([description['index'], description['instance_id'], description['state'],
+                       description['public_ip'], description['public_dns']])
+        log.echo_info(t)
 
     def instance_exists(self, instance_id):
         """
@@ -321,19 +904,25 @@ class Ec2Helper:
         :return: True if the instance exists, else return False
         """
         try:
-            self.ec2.describe_instances(InstanceIds=[instance_id])
+            self.get_instance_description(instance_id)
         except ClientError:
             return False
         return True
 
     def get_image_id(self, instance_id):
         """
-        Get image id from running instance
+        Get image id from running instance, kept in the disk cache since it never changes
         :param instance_id: Instance Id
         :return: Image Id
         """
-        instance = self.get_instance_description(instance_id)
-        return next(iter(instance.items()))[1][0]['Instances'][0]['ImageId']
+        key = 'instance:%s:%s' % (self.region, instance_id)
+        image_id = _IMAGE_CACHE.get(key)
+        metrics.record_cache('ec2.describe_instances(image)', image_id is not None)
+        if image_id is None:
+            instance = self.get_instance_description(instance_id)
+            image_id = next(iter(instance.items()))[1][0]['Instances'][0]['ImageId']
+            _IMAGE_CACHE.set(key, image_id)
+        return image_id
 
     def get_image_description(self, image_id):
         """
@@ -341,8 +930,7 @@ class Ec2Helper:
         :param image_id: Image Id
         :return: Image description
         """
-        image = self.ec2.describe_images(ImageIds=[image_id])
-        return image
+        return {'Images': [self.__get_image_metadata(image_id)['image']]}
 
     def get_image_distribution(self, instance_id):
         """
@@ -352,7 +940,7 @@ class Ec2Helper:
         """
         image_id = self.get_image_id(instance_id)
         image = self.get_image_description(image_id)
-        return next(iter(image.items()))[1][0]['Description']
+        return next(iter(image.items()))[1][0].get('Description', '')
 
     def get_image_user(self, instance_id):
         """
@@ -360,47 +948,111 @@ class Ec2Helper:
         :param instance_id: Instance Id
         :return: Image user to use (ec2-user, ubuntu, etc)
         """
-        image_distribution = self.get_image_distribution(instance_id)
-        if 'Ubuntu' in image_distribution or 'Canonical' in image_distribution:
-            return 'ubuntu'
-        else:
-            return 'ec2-user'
+        return self.__get_image_metadata(self.get_image_id(instance_id))['user']
+
+    def __get_image_metadata(self, image_id):
+        key = 'image:%s:%s' % (self.region, image_id)
+        metadata = _IMAGE_CACHE.get(key)
+        metrics.record_cache('ec2.describe_images', metadata is not None)
+        if metadata is None:
+            images = self.ec2.describe_images(ImageIds=[image_id])['Images']
+            if not images:
+                aw.exit_with_error('Image %s not found' % image_id)
+            image_distribution = images[0].get('Description', '')
+            if 'Ubuntu' in image_distribution or 'Canonical' in image_distribution:
+                user = 'ubuntu'
+            else:
+                user = 'ec2-user'
+            metadata = dict(image=images[0], user=user)
+            _IMAGE_CACHE.set(key, metadata)
+        return metadata
 
     def check_security_group_exists(self):
         """
-        Check if default security group exists
+        Check if default security group exists, the ledger is checked before the security group index
         :return: Security Group if security group exist, else return None
         """
-        security_groups = self.get_security_groups_by_name()
-        for security_group in security_groups:
-            if security_group[1] == DEFAULT_SECURITY_GROUP_NAME:
-                return security_group[0]
-        return None
+        recorded = ledger.get(ledger.SECURITY_GROUP, self.region, DEFAULT_SECURITY_GROUP_NAME)
+        if recorded is not None:
+            return recorded['resource_id']
+        return self.get_security_group_id(DEFAULT_SECURITY_GROUP_NAME)
 
     def get_security_group_id(self, security_group_name):
-        security_groups = self.get_security_groups_by_name()
-        for security_group in security_groups:
-            if security_group[1] == security_group_name:
-                return security_group[0]
-        return None
+        """
+        Get security group Id from the security group index
+        :param security_group_name: Security group name
+        :return: Security group Id, None if it doesn't exist
+        """
+        return self.lookup_security_groups(group_names=[security_group_name]).get_id_by_name(security_group_name)
 
     def add_inbound_rule(self, security_group_name, port, description='Default'):
-        ip_permission = self.DEFAULT_IP_PERMISSIONS
+        """
+        Allow the public IP of this host on a port of a security group
+        :param security_group_name: Security group name
+        :param port: Port to open
+        :param description: Rule description
+        """
+        ip_permission = copy.deepcopy(self.DEFAULT_IP_PERMISSIONS)
         ip_permission['IpRanges'][0]['CidrIp'] = aw.get_public_ip()
         ip_permission['FromPort'] = port
         ip_permission['ToPort'] = port
         ip_permission['IpRanges'][0]['Description'] = description
         security_group_id = self.get_security_group_id(security_group_name)
+        if security_group_id is None:
+            aw.exit_with_error("Security group '%s' not found" % security_group_name)
+        self.reconcile_inbound_rules(security_group_id, [ip_permission])
+
+    def reconcile_inbound_rules(self, security_group_id, ip_permissions):
+        """
+        Authorize the inbound rules a security group doesn't have yet, with a single authorize call
+        :param security_group_id: Security group Id
+        :param ip_permissions: Wanted IpPermissions, the existing rules are left untouched
+        :return: List with the IpPermissions that were added
+        """
+        response = self.ec2.describe_security_groups(GroupIds=[security_group_id])
+        current = response['SecurityGroups'][0]
+        missing = self.__get_missing_permissions(current.get('IpPermissions', []), ip_permissions)
+        if not missing:
+            log.echo_debug('Security group %s already has the inbound rules', security_group_id)
+            return missing
+        log.echo_info('Adding %d inbound rules to security group %s' % (len(missing), security_group_id))
         try:
-            security_group = self.ec2.SecurityGroup(security_group_id)
-            security_group.authorize_ingress(GroupId=security_group_id, IpPermissions=[ip_permission])
-        except ClientError:
-            pass
+            self.ec2.authorize_security_group_ingress(GroupId=security_group_id, IpPermissions=missing)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'InvalidPermission.Duplicate':
+                raise
+            log.echo_debug('Inbound rules of %s were added concurrently', security_group_id)
+        current = copy.deepcopy(current)
+        current['IpPermissions'] = current.get('IpPermissions', []) + missing
+        self.index_security_group(current)
+        return missing
+
+    @staticmethod
+    def __get_missing_permissions(current_permissions, ip_permissions):
+        existing = set()
+        for permission in current_permissions:
+            for ip_range in permission.get('IpRanges', []):
+                existing.add((permission['IpProtocol'], permission.get('FromPort'), permission.get('ToPort'),
+                              ip_range['CidrIp']))
+        missing = []
+        for permission in ip_permissions:
+            ip_ranges = [ip_range for ip_range in permission.get('IpRanges', [])
+                         if (permission['IpProtocol'], permission.get('FromPort'), permission.get('ToPort'),
+                             ip_range['CidrIp']) not in existing and
+                         ('-1', None, None, ip_range['CidrIp']) not in existing]
+            if ip_ranges:
+                permission = copy.deepcopy(permission)
+                permission['IpRanges'] = ip_ranges
+                missing.append(permission)
+        return missing
 
 
 class Ec2Process(Ec2Helper):
-    DEFAULT_SLEEP = 10
     DEFAULT_TIMEOUT = 600
+    DEFAULT_SSH_PORT = 22
+    DEFAULT_PROBE_TIMEOUT = 3
+    DEFAULT_BASE_DELAY = 1
+    DEFAULT_MAX_DELAY = 15
 
     def __init__(self, instance_id, **kwargs):
         self.kwargs = kwargs
@@ -436,17 +1088,10 @@ class Ec2Process(Ec2Helper):
         Wait for the instance to be running
         :return: Instance state
         """
-        log.echo_info('Wait %s seconds for EC2 instance (%s) to be ready' % (self.instance_id, self.DEFAULT_TIMEOUT))
-        running = False
-        timeout = time.time() + self.DEFAULT_TIMEOUT
-        while not running:
-            status = self.get_instance_status(self.instance_id)
-            if status == 'ok':
-                running = True
-                break
-            if time.time() > timeout:
-                break
-            time.sleep(self.DEFAULT_SLEEP)
+        log.echo_info('Wait %s seconds for EC2 instance (%s) to be ready' % (self.DEFAULT_TIMEOUT, self.instance_id))
+        running = waiter.get_engine().wait(waiter.EC2_INSTANCE, self.instance_id, self.region, ['ok'],
+                                           timeout=self.DEFAULT_TIMEOUT)
+        self.invalidate_instance(self.instance_id)
         return running
 
     def copy_to_instance(self):
@@ -455,47 +1100,148 @@ class Ec2Process(Ec2Helper):
         """
         log.echo_info('Copy file to EC2 Instance')
         ssh_client = self.get_instance_connection()
-        ftp_client = ssh_client.open_sftp()
-        ftp_client.put(self.deploy, aw.path_join(aw.get_tomcat_path(), aw.basename(self.deploy)))
-        log.echo_info('File Copied successfully')
-        ftp_client.close()
-        ssh_client.close()
+        digest = transfer.sync(ssh_client, self.deploy, aw.path_join(aw.get_tomcat_path(), aw.basename(self.deploy)))
+        log.echo_info('File Copied successfully (sha256 %s)' % digest)
 
     def get_instance_connection(self):
         """
-        Get ssh connection to the instance
+        Get ssh connection to the instance, connections are kept open and reused until the process exits
         :return: SSHClient object instance
         """
+        import paramiko as ssh
+        key_file = aw.path_join(self.key_path, self.key_pair_name + '.pem')
+        ssh_client = _SSH_SESSIONS.get((self.instance_id, key_file))
+        if ssh_client is not None and ssh_client.get_transport() and ssh_client.get_transport().is_active():
+            log.echo_info('Reusing SSH connection to %s' % self.instance_id)
+            return ssh_client
         log.echo_info('Get SSH connection info')
         log.echo_info('Using key file (%s) located on %s' % (self.key_pair_name + '.pem', self.key_path))
-        p_key = ssh.RSAKey.from_private_key_file(aw.path_join(self.key_path, self.key_pair_name + '.pem'))
+        p_key = ssh.RSAKey.from_private_key_file(key_file)
         ssh_client = ssh.SSHClient()
         ssh_client.set_missing_host_key_policy(ssh.AutoAddPolicy())
         self.wait_ssh_connection(p_key, ssh_client)
+        _SSH_SESSIONS[(self.instance_id, key_file)] = ssh_client
         return ssh_client
 
     def wait_ssh_connection(self, p_key, ssh_client):
         """
-        Wait to ssh connection to be established
+        Wait to ssh connection to be established. The public IP and user are resolved once, port 22 is
+        probed with a cheap TCP connect and exponential backoff, and the SSH handshake is only attempted
+        when the port is open
         :param p_key: Private Key pair
         :param ssh_client: SSH connection instance
-        :return:
+        :return: SSHClient object instance
         """
+        from paramiko.ssh_exception import SSHException
         log.echo_info('Wait %s seconds for SSH connection to be established' % self.DEFAULT_TIMEOUT)
-        running = False
-        timeout = time.time() + self.DEFAULT_TIMEOUT
+        deadline = time.time() + self.DEFAULT_TIMEOUT
         instance_user = self.get_image_user(self.instance_id)
         log.echo_info("Using User: %s to connect to instance" % instance_user)
-        while not running:
+        host = None
+        attempt = 0
+        while time.time() < deadline:
+            if host is None:
+                host = self.__get_public_ip_address()
+            if host and self.__probe_ssh_port(host, deadline):
+                try:
+                    ssh_client.connect(hostname=host, port=self.DEFAULT_SSH_PORT, username=instance_user, pkey=p_key,
+                                       timeout=self.DEFAULT_PROBE_TIMEOUT,
+                                       banner_timeout=self.DEFAULT_PROBE_TIMEOUT * 5,
+                                       auth_timeout=self.DEFAULT_PROBE_TIMEOUT * 5)
+                    if ssh_client.get_transport() is not None and ssh_client.get_transport().is_active():
+                        return ssh_client
+                except (SSHException, socket.error) as error:
+                    log.echo_debug('SSH connection to %s not ready: %s', host, error)
+            delay = min(self.DEFAULT_MAX_DELAY, self.DEFAULT_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.0)
+            time.sleep(max(0, min(delay, deadline - time.time())))
+            attempt += 1
+        aw.exit_with_error("Timeout Can't connect to instance")
+
+    def __get_public_ip_address(self):
+        instance = self.get_instance_description(self.instance_id)
+        return instance['Reservations'][0]['Instances'][0].get('PublicIpAddress')
+
+    def __probe_ssh_port(self, host, deadline):
+        timeout = max(0.1, min(self.DEFAULT_PROBE_TIMEOUT, deadline - time.time()))
+        try:
+            socket.create_connection((host, self.DEFAULT_SSH_PORT), timeout=timeout).close()
+        except socket.error:
+            return False
+        return True
+
+
+class Ec2Deployer:
+    """
+    Deploy the file to many instances in parallel, a slow or unreachable instance doesn't block the rest
+    """
+    DEFAULT_WORKERS = 8
+    DEFAULT_TIMEOUT = 900
+
+    def __init__(self, instance_ids, **kwargs):
+        self.kwargs = kwargs
+        self.instance_ids = instance_ids
+        self.workers = self.get_workers()
+        self.timeout = self.get_timeout()
+
+    def get_workers(self):
+        """
+        Get maximum number of instances deployed at the same time
+        :return: Number of workers
+        """
+        return int(self.kwargs['deploy_workers']) if 'deploy_workers' in self.kwargs else self.DEFAULT_WORKERS
+
+    def get_timeout(self):
+        """
+        Get seconds to wait for the whole deploy
+        :return: Timeout in seconds
+        """
+        return float(self.kwargs['deploy_timeout']) if 'deploy_timeout' in self.kwargs else self.DEFAULT_TIMEOUT
+
+    def deploy(self):
+        """
+        Deploy the file to every instance
+        :return: List of dictionaries (instance_id, status, seconds, error), status is ok, failed or timeout
+        """
+        log.echo_info('Deploying to %d instances with %d workers' % (len(self.instance_ids), self.workers))
+        results = {instance_id: dict(instance_id=instance_id, status='timeout', seconds=None, error=None)
+                   for instance_id in self.instance_ids}
+        pending = queue.Queue()
+        for instance_id in self.instance_ids:
+            pending.put(instance_id)
+        finished = threading.Semaphore(0)
+        parent = log.get_current_span()
+        for _ in range(min(self.workers, len(self.instance_ids))):
+            threading.Thread(target=self.__worker, args=(pending, results, finished, parent), daemon=True).start()
+        deadline = time.time() + self.timeout
+        for _ in self.instance_ids:
+            if not finished.acquire(timeout=max(0, deadline - time.time())):
+                log.echo_warning('Deploy timeout after %s seconds' % self.timeout)
+                break
+        return [dict(results[instance_id]) for instance_id in self.instance_ids]
+
+    def __worker(self, pending, results, finished, parent):
+        while True:
             try:
-                ssh_client.connect(hostname=self.get_instance_public_ip(self.instance_id), username=instance_user,
-                                   pkey=p_key)
-            except (NoValidConnectionsError or NewConnectionError or TimeoutError or socket.timeout):
-                continue
-            if ssh_client.get_transport().is_active():
-                time.sleep(10)
-                return ssh_client
-            if time.time() > timeout:
-                aw.exit_with_error("Timeout Can't connect to instance")
-            time.sleep(self.DEFAULT_SLEEP)
-        aw.exit_with_error("Can't connect to instance")
+                instance_id = pending.get_nowait()
+            except queue.Empty:
+                return
+            start = time.time()
+            try:
+                with log.span('Deploying to EC2 instance', parent=parent, instance_id=instance_id):
+                    Ec2Process(instance_id, **self.kwargs).copy_to_instance()
+                results[instance_id].update(status='ok', seconds=time.time() - start)
+            except (Exception, SystemExit) as error:
+                log.echo_error('Deploy to %s failed: %r' % (instance_id, error))
+                results[instance_id].update(status='failed', seconds=time.time() - start, error=repr(error))
+            finished.release()
+
+    def print_results(self, results):
+        """
+        Print the deploy result of every instance
+        :param results: Deploy results
+        """
+        t = PrettyTable(['InstanceId', 'Status', 'Seconds', 'Error'])
+        for result in results:
+            t.add_row([result['instance_id'], result['status'],
+                       '%.1f' % result['seconds'] if result['seconds'] is not None else '-', result['error'] or ''])
+        log.echo_info(t)
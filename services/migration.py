@@ -1,6 +1,6 @@
 import os
 from subprocess import CalledProcessError
-from awrapperlib import aw, logger as log, resource
+from awrapperlib import aw, dag, logger as log, resource
 from services import vpc as vpc_service, dms as dms_service
 
 
@@ -115,41 +115,37 @@ class Migration:
         aw.clear_resource_env()
 
     def run_dms_process(self):
-        log.echo_info('Beginning Data Migration')
-        self.kwargs['subnet_number'] = 2
-        log.echo_info('Creating VPC for Data Migration Service')
-        vpc = vpc_service.VPCCreation(**self.kwargs)
-        vpc.create_vpc()
-        log.echo_info('Creating VPC Subnet')
-        vpc.create_subnet()
-        log.echo_info('Creating Internet Gateway')
-        vpc.create_internet_gateway()
-        log.echo_info('Attaching Internet Gateway to VPC')
-        vpc.attach_igw()
-        log.echo_info('Creating Route Table')
-        vpc.create_route_table()
-        log.echo_info('Associating Subnet to Route Table')
-        vpc.associate_route_table()
-        log.echo_info('Creating Route to Internet Gateway')
-        vpc.create_igw_route()
-        self.kwargs['vpc_security_groups'] = vpc.get_vpc_default_security_group()
-        self.kwargs['subnet'] = vpc.get_subnet_id()
-        dms = dms_service.DMSCreation(**self.kwargs)
-        log.echo_info('Creating Data Migration Instance')
-        dms.create_dms_instance()
-        log.echo_info('Creating Source Endpoint')
-        dms.create_source_endpoint()
-        log.echo_info('Creating Target Endpoint')
-        dms.create_target_endpoint()
-        log.echo_info('Wait for Data Migration Instance to be Ready')
-        dms.wait_replication_instance()
-        log.echo_info('Creating Replication Task')
-        dms.create_replication_task()
-        log.echo_info('Wait for Replication Task to be Ready')
-        dms.wait_replication_task_ready()
-        log.echo_info('Wait for Endpoints test connection')
-        dms.wait_test_connection()
-        log.echo_info('Starting Data Migration')
-        dms.start_replication_task()
-        log.echo_info('Wait for Data Migration to start')
-        dms.wait_replication_task_starts()
+        with log.span('Beginning Data Migration'):
+            self.kwargs['subnet_number'] = 2
+            vpc = vpc_service.VPCCreation(**self.kwargs)
+            graph = dag.TaskGraph('VPC creation')
+            graph.add('vpc', vpc.create_vpc, description='Creating VPC for Data Migration Service')
+            graph.add('subnet', vpc.create_subnet, ['vpc'], 'Creating VPC Subnet')
+            graph.add('igw', vpc.create_internet_gateway, description='Creating Internet Gateway')
+            graph.add('attach_igw', vpc.attach_igw, ['vpc', 'igw'], 'Attaching Internet Gateway to VPC')
+            graph.add('route_table', vpc.create_route_table, ['vpc'], 'Creating Route Table')
+            graph.add('associate', vpc.associate_route_table, ['subnet', 'route_table'],
+                      'Associating Subnet to Route Table')
+            graph.add('igw_route', vpc.create_igw_route, ['route_table', 'attach_igw'],
+                      'Creating Route to Internet Gateway')
+            graph.add('security_group', vpc.get_vpc_default_security_group, ['vpc'],
+                      'Getting VPC default security group')
+            self.kwargs['vpc_security_groups'] = graph.run()['security_group']
+            self.kwargs['subnet'] = vpc.get_subnet_id()
+            dms = dms_service.DMSCreation(**self.kwargs)
+            with log.span('Creating Data Migration Instance'):
+                dms.create_dms_instance()
+            with log.span('Creating Source Endpoint'):
+                dms.create_source_endpoint()
+            with log.span('Creating Target Endpoint'):
+                dms.create_target_endpoint()
+            with log.span('Wait for Data Migration Instance to be Ready'):
+                dms.wait_replication_instance()
+            with log.span('Creating Replication Task'):
+                dms.create_replication_task()
+            with log.span('Wait for Replication Task to be Ready and Endpoints test connection'):
+                dms.wait_replication_task_ready_and_connection()
+            with log.span('Starting Data Migration'):
+                dms.start_replication_task()
+            with log.span('Wait for Data Migration to start'):
+                dms.wait_replication_task_starts()
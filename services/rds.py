@@ -1,6 +1,4 @@
-import boto3
-import time
-from awrapperlib import aw, logger as log
+from awrapperlib import aw, clients, waiter, logger as log
 
 DEFAULT_SECURITY_GROUP_NAME = 'rds-AWS-Wrapper'
 DEFAULT_REGION = aw.DEFAULT_REGION
@@ -22,7 +20,7 @@ class RDSFactory:
         self.name = self.get_name()
         self.db_name = self.get_db_name()
         self.region = self.get_region()
-        self.rds = boto3.client('rds', region_name=self.region)
+        self.rds = clients.get_client('rds', self.region)
         self.instance_class = self.get_instance_class()
         self.engine = self.get_engine()
         self.alloc_storage = self.get_alloc_storage()
@@ -153,13 +151,12 @@ class RDS(RDSFactory):
 
 
 class RDSHelper:
-    DEFAULT_SLEEP = 10
     DEFAULT_TIMEOUT = 600
 
     def __init__(self, **kwargs):
         self.kwargs = kwargs
         self.region = self.get_region()
-        self.rds = boto3.client('rds', region_name=self.region)
+        self.rds = clients.get_client('rds', self.region)
         self.response = []
 
     def get_region(self):
@@ -178,15 +175,8 @@ class RDSHelper:
         return next(iter(response.items()))[1][0]['Endpoint']['Address']
 
     def wait_for_instance(self, instance_id):
-        log.echo_info('Wait %s seconds for RDS instance (%s) to be ready' % (instance_id, self.DEFAULT_TIMEOUT))
-        running = False
-        timeout = time.time() + self.DEFAULT_TIMEOUT
-        while not running:
-            status = self.get_instance_status(instance_id)
-            if status == 'available':
-                running = True
-                break
-            if time.time() > timeout:
-                break
-            time.sleep(self.DEFAULT_SLEEP)
-        return running
+        log.echo_info('Wait %s seconds for RDS instance (%s) to be ready' % (self.DEFAULT_TIMEOUT, instance_id))
+        return waiter.get_engine().wait(waiter.RDS_INSTANCE, instance_id, self.region, ['available'],
+                                        ['failed', 'incompatible-parameters', 'incompatible-restore',
+                                         'storage-full', 'inaccessible-encryption-credentials'],
+                                        timeout=self.DEFAULT_TIMEOUT)
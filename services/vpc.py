@@ -1,5 +1,4 @@
-import boto3
-from awrapperlib import aw, logger as log
+from awrapperlib import aw, clients, logger as log
 
 
 class VPCFactory:
@@ -22,7 +21,7 @@ class VPCFactory:
         self.route_name = self.get_route_name()
         self.cidr_block = self.get_cidr_block()
         self.subnet_cidr = self.get_subnet_cidr()
-        self.vpc_client = boto3.client('ec2', region_name=self.region)
+        self.vpc_client = clients.get_client('ec2', self.region)
 
     def get_region(self):
         return self.kwargs['region'] if 'region' in self.kwargs else aw.DEFAULT_REGION
@@ -66,9 +65,9 @@ class VPCCreation(VPCFactory):
 
     def create_vpc(self):
         response = self.vpc_client.create_vpc(CidrBlock=self.cidr_block, AmazonProvidedIpv6CidrBlock=False,
-                                              InstanceTenancy='default')
+                                              InstanceTenancy='default',
+                                              TagSpecifications=self.__get_name_tag('vpc', self.vpc_name))
         setattr(self, 'vpc_id', response['Vpc']['VpcId'])
-        self.__create_name_tag(getattr(self, 'vpc_id'), self.vpc_name)
         log.echo_info('Created VPC %s' % self.__get_vpc_id())
 
     def create_subnet(self):
@@ -82,17 +81,19 @@ class VPCCreation(VPCFactory):
                 self.__create_sub_net(self.subnet_cidr, self.subnet_names)
 
     def __create_sub_net(self, cidr_block, name, az=None):
+        tags = self.__get_name_tag('subnet', name)
         if az:
             response = self.vpc_client.create_subnet(CidrBlock=cidr_block, VpcId=self.__get_vpc_id(),
-                                                     AvailabilityZone=az)
+                                                     AvailabilityZone=az, TagSpecifications=tags)
         else:
-            response = self.vpc_client.create_subnet(CidrBlock=cidr_block, VpcId=self.__get_vpc_id())
-        self.__create_name_tag(response['Subnet']['SubnetId'], name)
+            response = self.vpc_client.create_subnet(CidrBlock=cidr_block, VpcId=self.__get_vpc_id(),
+                                                     TagSpecifications=tags)
         self.__set_subnet_id(response['Subnet']['SubnetId'])
         log.echo_info('Created Subnet %s' % response['Subnet']['SubnetId'])
 
-    def __create_name_tag(self, resource_id, name):
-        self.vpc_client.create_tags(Resources=[resource_id], Tags=[{'Key': 'Name', 'Value': name}])
+    @staticmethod
+    def __get_name_tag(resource_type, name):
+        return [{'ResourceType': resource_type, 'Tags': [{'Key': 'Name', 'Value': name}]}]
 
     def __get_vpc_id(self):
         return getattr(self, 'vpc_id')
@@ -112,25 +113,26 @@ class VPCCreation(VPCFactory):
             setattr(self, 'subnet_id', subnet)
 
     def create_route_table(self):
-        response = self.vpc_client.create_route_table(VpcId=self.__get_vpc_id())
+        response = self.vpc_client.create_route_table(VpcId=self.__get_vpc_id(),
+                                                      TagSpecifications=self.__get_name_tag('route-table',
+                                                                                            self.route_name))
         self.__set_route_table(response['RouteTable']['RouteTableId'])
         log.echo_info('Created Route Table %s' % self.__get_route_table())
 
     def __set_route_table(self, route_table_id):
         setattr(self, 'route_table_id', route_table_id)
-        self.__create_name_tag(route_table_id, self.route_name)
 
     def __get_route_table(self):
         return getattr(self, 'route_table_id')
 
     def create_internet_gateway(self):
-        response = self.vpc_client.create_internet_gateway()
+        response = self.vpc_client.create_internet_gateway(
+            TagSpecifications=self.__get_name_tag('internet-gateway', self.igw_name))
         self.__set_igw(response['InternetGateway']['InternetGatewayId'])
         log.echo_info('Created Internet Gateway %s' % self.__get_igw())
 
     def __set_igw(self, igw_id):
         setattr(self, 'igw_id', igw_id)
-        self.__create_name_tag(igw_id, self.igw_name)
 
     def __get_igw(self):
         return getattr(self, 'igw_id')